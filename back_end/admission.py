@@ -0,0 +1,338 @@
+# coding=utf-8
+"""
+准入控制：按客户端限流 + 优先级排队，在任何 LLM / 图查询工作开始之前拒绝超额请求。
+
+开启：ADMISSION_ENABLED=1（默认关闭，关闭时不注册任何钩子）。
+
+- 客户端键：默认为对端 IP（remote_addr），类别固定为 interactive。请求头可由客户端任意伪造，
+  因此只有携带已配置 API Key（请求头 X-Client-Key）的请求才按该 Key 计数，并可用 X-Priority
+  在该 Key 允许的类别中选择；未知 Key 与未携带 Key 的请求同等对待。
+  ADMISSION_API_KEYS（JSON）配置 Key → 客户端名与允许的类别（第一个为缺省类别），统计中只出现客户端名：
+    {"<key>": {"client": "eval-job", "classes": ["batch"]}}
+- 令牌桶：每个 (客户端, 类别) 一个桶，按类别配置速率与容量；每个接口消耗的令牌数见 ENDPOINT_COSTS。
+  桶默认放在进程内存中；设置 ADMISSION_STORE=<sqlite 路径> 时放在本地 SQLite 中，prefork 的各 worker 共享。
+  prefork 多 worker 时进程内的桶会按 worker 数成倍放大额度，serve.py 在未设置 ADMISSION_STORE 时拒绝启动
+- 重接口（/query_v2，会占用本地 LLM）另有并发闸门：同时最多 ADMISSION_HEAVY_CONCURRENCY 个，
+  等待者按 (优先级, 到达顺序) 出队；队列满立即 429，等待超过 ADMISSION_QUEUE_TIMEOUT 秒返回 503。
+  闸门始终是进程内的：prefork 下整体并发上限为 worker 数 × ADMISSION_HEAVY_CONCURRENCY
+- 拒绝发生在 Flask before_request 中，不解析请求体，只做一次字典/SQLite 查找；
+  只对各接口实际服务的方法（CHARGED_METHODS）计费，CORS 预检 OPTIONS 等请求不消耗令牌、不占闸门
+- GET /admission/stats 导出各客户端计数（JSON；?format=prometheus 为 Prometheus 文本格式）。
+  统计中含客户端地址，需设置 ADMISSION_STATS_TOKEN 并在请求头 X-Admission-Token 中携带，未设置时不注册该接口
+
+类别配置可用 ADMISSION_CLASSES（JSON）覆盖，如：
+    {"interactive": {"rate": 2, "burst": 20, "priority": 0, "max_queue": 32},
+     "batch": {"rate": 1, "burst": 10, "priority": 1, "max_queue": 8}}
+"""
+import hashlib
+import heapq
+import hmac
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from cache import LRUCache
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "0") == "1"
+ADMISSION_STORE = os.getenv("ADMISSION_STORE", "")
+ADMISSION_STATS_TOKEN = os.getenv("ADMISSION_STATS_TOKEN", "")
+HEAVY_CONCURRENCY = int(os.getenv("ADMISSION_HEAVY_CONCURRENCY", "1"))
+QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "120"))
+MAX_CLIENTS = int(os.getenv("ADMISSION_MAX_CLIENTS", "10000"))
+
+DEFAULT_CLASSES = {
+    "interactive": {"rate": 2.0, "burst": 20.0, "priority": 0, "max_queue": 32},
+    "batch": {"rate": 1.0, "burst": 10.0, "priority": 1, "max_queue": 8},
+}
+DEFAULT_CLASS = "interactive"
+
+# 每个接口消耗的令牌数；未列出的路径不限流
+ENDPOINT_COSTS = {
+    "/query": 1.0,
+    "/query_v2": 10.0,
+}
+HEAVY_ENDPOINTS = {"/query_v2"}
+# 上述接口只服务 POST；其他方法（CORS 预检 OPTIONS、会返回 405 的 GET 等）不计费
+CHARGED_METHODS = {"POST"}
+# Retry-After 的上限（秒）；速率为 0 的类别等待时间为无穷大
+MAX_RETRY_AFTER = 3600
+
+
+def load_api_keys() -> dict:
+    """ADMISSION_API_KEYS → {sha256(key): (客户端名, 允许的类别列表)}；按摘要查找，不直接拿明文 Key 比较"""
+    api_keys = {}
+    for key, conf in json.loads(os.getenv("ADMISSION_API_KEYS") or "{}").items():
+        classes = conf.get("classes") or [DEFAULT_CLASS]
+        api_keys[hashlib.sha256(key.encode("utf-8")).hexdigest()] = (conf.get("client") or "key", list(classes))
+    return api_keys
+
+
+def _prometheus_label(value) -> str:
+    """Prometheus 文本格式的标签值转义：反斜杠、双引号、换行"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def load_classes() -> dict:
+    classes = {name: dict(conf) for name, conf in DEFAULT_CLASSES.items()}
+    override = os.getenv("ADMISSION_CLASSES")
+    if override:
+        for name, conf in json.loads(override).items():
+            classes.setdefault(name, dict(DEFAULT_CLASSES[DEFAULT_CLASS])).update(conf)
+    return classes
+
+
+# ==============================================================================
+# 令牌桶存储
+# ==============================================================================
+class MemoryBucketStore:
+    """进程内令牌桶；客户端数量按 LRU 限制"""
+
+    def __init__(self, max_clients: int = MAX_CLIENTS):
+        self._buckets = LRUCache(max_clients)
+        self._lock = threading.Lock()
+
+    def take(self, key, cost, rate, burst):
+        """尝试取 cost 个令牌；成功返回 (True, 0)，失败返回 (False, 需要等待的秒数)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key) or (burst, now)
+            tokens = min(burst, tokens + (now - last) * rate)
+            if tokens >= cost:
+                self._buckets.put(key, (tokens - cost, now))
+                return True, 0.0
+            self._buckets.put(key, (tokens, now))
+            return False, (cost - tokens) / rate if rate > 0 else float("inf")
+
+
+class SQLiteBucketStore:
+    """本地 SQLite 中的令牌桶，多个 worker 进程共享同一份额度"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, cost, rate, burst):
+        key = "\t".join(key)
+        now = time.time()
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, last = row if row else (burst, now)
+            tokens = min(burst, tokens + max(0.0, now - last) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if allowed:
+            return True, 0.0
+        return False, (cost - tokens) / rate if rate > 0 else float("inf")
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+# ==============================================================================
+# 重接口的优先级闸门
+# ==============================================================================
+class PriorityGate:
+    """并发上限为 capacity 的闸门；等待者按 (优先级, 到达顺序) 获得许可"""
+
+    def __init__(self, capacity: int = HEAVY_CONCURRENCY):
+        self.capacity = capacity
+        self.active = 0
+        self._waiters = []
+        self._queued = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def queued(self, cls: str) -> int:
+        with self._cond:
+            return self._queued.get(cls, 0)
+
+    def acquire(self, cls: str, priority: int, max_queue: int, timeout: float):
+        """返回 "ok" / "queue_full" / "timeout" """
+        with self._cond:
+            if self.active < self.capacity and not self._waiters:
+                self.active += 1
+                return "ok"
+            if self._queued.get(cls, 0) >= max_queue:
+                return "queue_full"
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._waiters, entry)
+            self._queued[cls] = self._queued.get(cls, 0) + 1
+            deadline = time.monotonic() + timeout
+            try:
+                while not (self.active < self.capacity and self._waiters[0] == entry):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._waiters.remove(entry)
+                        heapq.heapify(self._waiters)
+                        self._cond.notify_all()
+                        return "timeout"
+                    self._cond.wait(remaining)
+                heapq.heappop(self._waiters)
+                self.active += 1
+                return "ok"
+            finally:
+                self._queued[cls] -= 1
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+
+# ==============================================================================
+# 准入控制器
+# ==============================================================================
+class AdmissionController:
+    def __init__(self, classes: dict = None, store=None, gate: PriorityGate = None, api_keys: dict = None):
+        self.classes = classes or load_classes()
+        self.api_keys = load_api_keys() if api_keys is None else api_keys
+        self.store = store or (SQLiteBucketStore(ADMISSION_STORE) if ADMISSION_STORE else MemoryBucketStore())
+        self.gate = gate or PriorityGate()
+        self.counters = LRUCache(MAX_CLIENTS)
+        self._lock = threading.Lock()
+
+    def _count(self, client, cls, field, value=1):
+        with self._lock:
+            stats = self.counters.get((client, cls))
+            if stats is None:
+                stats = {"admitted": 0, "rejected_rate": 0, "rejected_queue": 0, "queue_timeout": 0, "queued_ms": 0.0}
+                self.counters.put((client, cls), stats)
+            stats[field] += value
+
+    def identify(self, remote_addr: str, api_key: str = None, priority: str = None):
+        """
+        返回 (客户端, 类别)。只有已配置的 API Key 才能自报身份和类别（且类别须在该 Key 允许的范围内），
+        其余请求按对端地址计数、使用缺省类别
+        """
+        if api_key:
+            entry = self.api_keys.get(hashlib.sha256(api_key.encode("utf-8")).hexdigest())
+            if entry is not None:
+                client, allowed = entry
+                return f"key:{client}", priority if priority in allowed else allowed[0]
+        return f"ip:{remote_addr or '-'}", DEFAULT_CLASS
+
+    def admit(self, client: str, cls: str, path: str, method: str = "POST"):
+        """
+        返回 (status, retry_after, holds_gate)：status 为 200 / 429 / 503；
+        holds_gate 为 True 时请求结束后必须调用 release()
+        """
+        cost = ENDPOINT_COSTS.get(path)
+        if cost is None or method not in CHARGED_METHODS:
+            return 200, 0.0, False
+        if cls not in self.classes:
+            cls = DEFAULT_CLASS
+        conf = self.classes[cls]
+        allowed, retry_after = self.store.take((client, cls), cost, conf["rate"], conf["burst"])
+        if not allowed:
+            self._count(client, cls, "rejected_rate")
+            return 429, retry_after, False
+        if path not in HEAVY_ENDPOINTS:
+            self._count(client, cls, "admitted")
+            return 200, 0.0, False
+
+        start = time.perf_counter()
+        result = self.gate.acquire(cls, conf["priority"], conf["max_queue"], QUEUE_TIMEOUT)
+        if result == "queue_full":
+            self._count(client, cls, "rejected_queue")
+            return 429, 1.0, False
+        if result == "timeout":
+            self._count(client, cls, "queue_timeout")
+            return 503, 1.0, False
+        self._count(client, cls, "admitted")
+        self._count(client, cls, "queued_ms", (time.perf_counter() - start) * 1000)
+        return 200, 0.0, True
+
+    def release(self):
+        self.gate.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            clients = [
+                {"client": client, "class": cls, **{k: round(v, 1) if isinstance(v, float) else v for k, v in s.items()}}
+                for (client, cls), s in self.counters.items()
+            ]
+        return {
+            "pid": os.getpid(),
+            "heavy_active": self.gate.active,
+            "heavy_queued": {cls: self.gate.queued(cls) for cls in self.classes},
+            "clients": clients,
+        }
+
+    def prometheus(self) -> str:
+        lines = []
+        for row in self.stats()["clients"]:
+            labels = f'client="{_prometheus_label(row["client"])}",class="{_prometheus_label(row["class"])}"'
+            for field in ("admitted", "rejected_rate", "rejected_queue", "queue_timeout", "queued_ms"):
+                lines.append(f"kg_admission_{field}_total{{{labels}}} {row[field]}")
+        return "\n".join(lines) + "\n"
+
+
+def register_admission(app):
+    """ADMISSION_ENABLED=1 时为 Flask 应用注册准入控制钩子和统计接口"""
+    if not ADMISSION_ENABLED:
+        return None
+
+    from flask import Response, g, jsonify, request
+
+    controller = AdmissionController()
+
+    @app.before_request
+    def _admit():
+        client, cls = controller.identify(
+            request.remote_addr, request.headers.get("X-Client-Key"), request.headers.get("X-Priority")
+        )
+        status, retry_after, holds_gate = controller.admit(client, cls, request.path, request.method)
+        if status != 200:
+            msg = "请求过于频繁，请稍后重试" if status == 429 else "服务繁忙，请稍后重试"
+            response = jsonify({"state": 1, "msg": msg})
+            response.status_code = status
+            response.headers["Retry-After"] = str(max(1, int(min(retry_after, MAX_RETRY_AFTER) + 0.999)))
+            return response
+        if holds_gate:
+            g.admission_gate = True
+
+    @app.teardown_request
+    def _release(exc):
+        if g.pop("admission_gate", False):
+            controller.release()
+
+    if not ADMISSION_STATS_TOKEN:
+        print("[ADMISSION] 未设置 ADMISSION_STATS_TOKEN，统计接口不启用")
+        return controller
+
+    @app.route('/admission/stats', methods=['GET'])
+    def admission_stats():
+        if not hmac.compare_digest(request.headers.get("X-Admission-Token", "").encode("utf-8"),
+                                   ADMISSION_STATS_TOKEN.encode("utf-8")):
+            return jsonify({"state": 1, "msg": "无权限"}), 403
+        if request.args.get("format") == "prometheus":
+            return Response(controller.prometheus(), mimetype="text/plain")
+        return jsonify(controller.stats())
+
+    return controller
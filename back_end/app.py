@@ -2,11 +2,15 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 
+from admission import register_admission
 from handler import query_handler
+from profiling import register_profiling
 from two_stage import two_stage_qa
 
 app = Flask(__name__)
 CORS(app)
+register_admission(app)
+register_profiling(app)
 
 
 @app.route('/')
@@ -14,6 +18,17 @@ def index():
     return 'server running'
 
 
+def _parse_bool(value):
+    """布尔请求参数：接受 JSON 布尔值或 "true"/"false"/"1"/"0"，缺省为 None（使用服务端默认）"""
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ("true", "1"):
+        return True
+    if isinstance(value, str) and value.strip().lower() in ("false", "0"):
+        return False
+    raise ValueError(f"single_pass必须是布尔值: {value!r}")
+
+
 @app.route('/query_v2', methods=['POST'])
 def query_v2():
     try:
@@ -21,7 +36,11 @@ def query_v2():
         if not data or 'question' not in data:
             return jsonify({"state": 1, "msg": "缺少question参数"}), 400
         question = data["question"]
-        result = two_stage_qa(question)
+        try:
+            single_pass = _parse_bool(data.get("single_pass"))
+        except ValueError as e:
+            return jsonify({"state": 1, "msg": str(e)}), 400
+        result = two_stage_qa(question, single_pass=single_pass)
         return jsonify(result)
     except Exception as e:
         return jsonify({"state": 1, "msg": f"处理出错: {str(e)}"}), 500
@@ -34,7 +53,11 @@ def query():
         if not data or 'question' not in data:
             return jsonify({"state": 1, "msg": "缺少question参数"}), 400
         question = data["question"]
-        return query_handler(question)
+        return query_handler(
+            question,
+            page_size=data.get("page_size"),
+            cursor=data.get("cursor")
+        )
     except Exception as e:
         return jsonify({"state": 1, "msg": f"处理出错: {str(e)}"}), 500
 
@@ -0,0 +1,111 @@
+# coding=utf-8
+"""
+图后端基准测试：比较 Neo4j 与嵌入式 SQLite 的一跳查询延迟和吞吐。
+
+用法：
+    python benchmark_backends.py                    # 两个后端都测（Neo4j 不可用时跳过）
+    python benchmark_backends.py --backends sqlite --rounds 5 --threads 8
+"""
+import argparse
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from graph_backend import Neo4jBackend, SQLiteBackend
+
+# 每类实体可用的模板下标（见 handler.patterns）
+TEMPLATES_BY_LABEL = {
+    "作品": [0, 1, 2],
+    "专辑": [3],
+    "人物": [4, 5, 6],
+}
+
+
+def build_workload(backend, size, seed=0):
+    """从后端的实体列表中随机生成 (模板下标, 实体) 查询"""
+    entities = {label: backend.list_entities(label) for label in TEMPLATES_BY_LABEL}
+    rng = random.Random(seed)
+    workload = []
+    labels = [label for label, names in entities.items() if names]
+    for _ in range(size):
+        label = rng.choice(labels)
+        workload.append((rng.choice(TEMPLATES_BY_LABEL[label]), rng.choice(entities[label])))
+    return workload
+
+
+def run_lookup(backend, index, val):
+    return list(backend.run_template(index, val, after=(), limit=11))
+
+
+def measure(backend, workload, threads):
+    latencies = []
+
+    def timed(item):
+        start = time.perf_counter()
+        run_lookup(backend, *item)
+        return time.perf_counter() - start
+
+    # 预热
+    for item in workload[:50]:
+        run_lookup(backend, *item)
+
+    start = time.perf_counter()
+    if threads <= 1:
+        latencies = [timed(item) for item in workload]
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            latencies = list(pool.map(timed, workload))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "queries": len(workload),
+        "throughput_qps": len(workload) / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+    }
+
+
+def make_backend(kind):
+    if kind == "neo4j":
+        backend = Neo4jBackend()
+        backend.list_entities("人物")  # 触发连接，失败时抛异常
+        return backend
+    backend = SQLiteBackend(":memory:")
+    backend.load_csv()
+    return backend
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较图后端的查询延迟与吞吐")
+    parser.add_argument("--backends", nargs="+", default=["neo4j", "sqlite"], choices=["neo4j", "sqlite"])
+    parser.add_argument("--queries", type=int, default=2000, help="每轮查询数")
+    parser.add_argument("--threads", type=int, default=1, help="并发线程数")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    for kind in args.backends:
+        try:
+            backend = make_backend(kind)
+        except Exception as e:
+            print(f"[{kind}] 跳过：无法连接 ({e})")
+            continue
+        try:
+            workload = build_workload(backend, args.queries)
+            for r in range(args.rounds):
+                stats = measure(backend, workload, args.threads)
+                print(
+                    f"[{kind}] round {r + 1}: {stats['queries']} queries, "
+                    f"{stats['throughput_qps']:.0f} q/s, "
+                    f"p50 {stats['p50_ms']:.3f} ms, p95 {stats['p95_ms']:.3f} ms, "
+                    f"p99 {stats['p99_ms']:.3f} ms, mean {stats['mean_ms']:.3f} ms"
+                )
+        finally:
+            backend.close()
+
+
+if __name__ == "__main__":
+    main()
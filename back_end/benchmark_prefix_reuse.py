@@ -0,0 +1,61 @@
+# coding=utf-8
+"""
+抽取 Prompt 前缀复用的收益：分别在 LLM_PREFIX_REUSE=off / context 下
+对同一批 LLM 回答执行抽取，比较 Ollama 报告的每次 Prompt 求值耗时和 token 数。
+
+需要运行中的 Ollama：
+    python benchmark_prefix_reuse.py --calls 20
+"""
+import argparse
+import json
+import statistics
+
+import llm
+from entity_extractor import EXTRACTION_PROMPT_PREFIX, EXTRACTION_PROMPT_SUFFIX, EXTRACTION_PROMPT_VERSION
+
+
+def run(mode, answers):
+    llm.LLM_PREFIX_REUSE = mode
+    llm.prefix_cache.clear()
+    eval_ms, eval_tokens, total_ms = [], [], []
+    for answer in answers:
+        _, metrics = llm.generate_with_prefix(
+            EXTRACTION_PROMPT_PREFIX,
+            EXTRACTION_PROMPT_SUFFIX.format(llm_answer=answer),
+            EXTRACTION_PROMPT_VERSION
+        )
+        eval_ms.append(metrics["prompt_eval_ms"])
+        eval_tokens.append(metrics["prompt_eval_tokens"])
+        total_ms.append(metrics["total_ms"])
+    return {
+        "prompt_eval_ms": statistics.mean(eval_ms),
+        "prompt_eval_tokens": statistics.mean(eval_tokens),
+        "total_ms": statistics.mean(total_ms),
+        "prefix_eval_ms": llm.prefix_cache.stats["prefix_eval_ms"],
+        "primes": llm.prefix_cache.stats["primes"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="抽取 Prompt 前缀复用的 Prompt 求值耗时对比")
+    parser.add_argument("--corpus", default="test_cases.json")
+    parser.add_argument("--calls", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(args.corpus, "r", encoding="utf-8") as f:
+        answers = [c["llm_answer"] for c in json.load(f) if c.get("llm_answer")][:args.calls]
+
+    off = run("off", answers)
+    ctx = run("context", answers)
+    print(f"模型: {llm.LLM_MODEL}，调用次数: {len(answers)}，前缀版本: {EXTRACTION_PROMPT_VERSION}")
+    print(f"{'':10s}{'prompt eval ms':>16s}{'prompt tokens':>16s}{'total ms':>12s}")
+    print(f"{'off':10s}{off['prompt_eval_ms']:16.1f}{off['prompt_eval_tokens']:16.1f}{off['total_ms']:12.1f}")
+    print(f"{'context':10s}{ctx['prompt_eval_ms']:16.1f}{ctx['prompt_eval_tokens']:16.1f}{ctx['total_ms']:12.1f}")
+    if not llm.LLM_PROMPT_TEMPLATE:
+        print("未设置 LLM_PROMPT_TEMPLATE：前缀复用不生效，两种模式都发送完整 Prompt")
+    print(f"前缀单独求值耗时（{ctx['primes']} 次预热合计）: {ctx['prefix_eval_ms']:.1f} ms")
+    print(f"每次调用节省的 Prompt 求值耗时: {off['prompt_eval_ms'] - ctx['prompt_eval_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
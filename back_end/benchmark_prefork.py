@@ -0,0 +1,77 @@
+# coding=utf-8
+"""
+prefork 扩展性基准：分别以 1、2、4 ... 个 worker 启动 serve.py，
+用 loadtest 的闭环压测测量 /query 的吞吐，观察吞吐随核数的变化。
+
+默认使用 SQLite 图后端，不需要 Neo4j：
+    python benchmark_prefork.py --workers 1 2 4 --requests 3000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+from loadtest import Recorder, build_report, load_corpus, make_http_sender, run_closed_loop
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def wait_ready(url, timeout=30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError(f"服务未在 {timeout}s 内启动: {url}")
+
+
+def bench(workers, port, questions, total, concurrency_per_worker):
+    env = dict(os.environ)
+    env.setdefault("KG_BACKEND", "sqlite")
+    env.setdefault("KG_SQLITE_PATH", ":memory:")
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, "serve.py"), "--workers", str(workers), "--port", str(port)],
+        cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        base = f"http://127.0.0.1:{port}"
+        wait_ready(base + "/")
+        send = make_http_sender(base, "query", timeout=30)
+        for q in questions[:20]:  # 预热
+            send(q)
+        recorder = Recorder()
+        start = time.perf_counter()
+        run_closed_loop(send, questions, total, concurrency_per_worker * workers, recorder)
+        return build_report(recorder, total, time.perf_counter() - start)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="prefork 吞吐随 worker 数的扩展性")
+    parser.add_argument("--corpus", default=os.path.join(HERE, "test_cases.json"))
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency-per-worker", type=int, default=4)
+    parser.add_argument("--port", type=int, default=5101)
+    args = parser.parse_args()
+
+    questions = [c["question"] for c in load_corpus(args.corpus)]
+    print(f"CPU 核数: {os.cpu_count()}")
+    baseline = None
+    for workers in args.workers:
+        report = bench(workers, args.port, questions, args.requests, args.concurrency_per_worker)
+        rps = report["throughput_rps"]
+        baseline = baseline or rps
+        print(f"workers={workers:2d}  {rps:8.1f} req/s  x{rps / baseline:4.2f}  "
+              f"p50 {report['latency_ms']['p50']:.1f} ms  p99 {report['latency_ms']['p99']:.1f} ms  "
+              f"errors {report['errors']}  state!=0 {report['app_errors']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# coding=utf-8
+"""
+图数据导入前的 CSV 预检：流式校验、规范化、去重。
+
+- 名称规范化：去掉首尾空白和零宽字符，连续空白合并为一个空格，全角字母/数字/空格转半角，
+  去掉整体包裹名称的书名号《》。中文全角标点（！？，等）是歌名的一部分，保持不变。
+- 节点：三个节点 CSV 读入内存（按类型的名称集合），规范化后重复的名称只保留一个。
+- 关系：relation.csv 逐行读取，不整体载入；关系类型未知、端点在节点 CSV 中不存在、
+  与前面的行完全重复的都会被拒绝。
+- 被拒绝的行写入拒绝报告（CSV：文件、行号、原因、原始内容），并按原因计数。
+
+本模块同时是 CSV 格式（节点文件、关系类型）的唯一定义，graph_backend 与 data/02_import_to_neo4j.py 都从这里导入。
+
+用法（在 back_end 目录下，默认读取 ../data）：
+    python csv_preflight.py                              # 只校验，打印统计
+    python csv_preflight.py --rejects rejects.csv        # 同时写出拒绝报告
+    python csv_preflight.py --output-dir clean/          # 写出清洗后的 CSV
+"""
+import argparse
+import csv
+import os
+import re
+from typing import Dict, Iterator, List, Tuple
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+
+# 节点 CSV 文件名 → (标签, 名称列)
+NODE_FILES = {
+    "专辑.csv": ("专辑", "专辑名称"),
+    "音乐作品.csv": ("作品", "所有音乐作品"),
+    "人物.csv": ("人物", "人物列表"),
+}
+RELATION_FILE = "relation.csv"
+
+# 关系类型 → (起点标签, 终点标签)
+RELATION_LABELS = {
+    "所属专辑": ("作品", "专辑"),
+    "歌手": ("作品", "人物"),
+    "作词": ("作品", "人物"),
+}
+
+_ZERO_WIDTH = dict.fromkeys(map(ord, "\u200b\u200c\u200d\u2060\ufeff"), None)
+_WHITESPACE = re.compile(r"\s+")
+# 全角字母、数字 → 半角；全角空格 → 半角空格
+_FULLWIDTH = {code: code - 0xFEE0 for code in range(0xFF10, 0xFF1A)}
+_FULLWIDTH.update({code: code - 0xFEE0 for code in range(0xFF21, 0xFF3B)})
+_FULLWIDTH.update({code: code - 0xFEE0 for code in range(0xFF41, 0xFF5B)})
+_FULLWIDTH[0x3000] = 0x20
+
+
+def normalize_name(text: str) -> str:
+    if not text:
+        return ""
+    text = text.translate(_ZERO_WIDTH).translate(_FULLWIDTH)
+    text = _WHITESPACE.sub(" ", text).strip()
+    if text.startswith("《") and text.endswith("》"):
+        text = text[1:-1].strip()
+    return text
+
+
+class PreflightReport:
+    """按原因统计被拒绝的行，并可流式写出拒绝明细"""
+
+    def __init__(self, rejects_path: str = None):
+        self.accepted = {}
+        self.rejected = {}
+        self.normalized = 0
+        self._file = None
+        self._writer = None
+        if rejects_path:
+            self._file = open(rejects_path, "w", encoding="utf-8", newline="")
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(["file", "line", "reason", "row"])
+
+    def accept(self, kind: str):
+        self.accepted[kind] = self.accepted.get(kind, 0) + 1
+
+    def reject(self, filename: str, line: int, reason: str, row):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        if self._writer is not None:
+            self._writer.writerow([filename, line, reason, "|".join(row)])
+
+    def summary(self) -> str:
+        accepted = ", ".join(f"{k} {v}" for k, v in self.accepted.items())
+        rejected = ", ".join(f"{k} {v}" for k, v in self.rejected.items()) or "无"
+        return f"通过: {accepted}；规范化名称 {self.normalized} 个；拒绝: {rejected}"
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._writer = None
+
+
+class CsvPreflight:
+    def __init__(self, data_dir: str = DATA_DIR, rejects_path: str = None):
+        self.data_dir = data_dir
+        self.report = PreflightReport(rejects_path)
+        self._nodes = None
+
+    def _normalize(self, raw: str) -> str:
+        name = normalize_name(raw)
+        if name and name != raw:
+            self.report.normalized += 1
+        return name
+
+    def nodes(self) -> Dict[str, List[str]]:
+        """{标签: [规范化后的名称, ...]}，结果缓存，供关系校验使用"""
+        if self._nodes is None:
+            nodes = {}
+            for filename, (label, column) in NODE_FILES.items():
+                seen = set()
+                names = []
+                with open(os.path.join(self.data_dir, filename), "r", encoding="utf-8") as f:
+                    reader = csv.DictReader(f)
+                    for row in reader:
+                        raw = row.get(column) or ""
+                        name = self._normalize(raw)
+                        if not name:
+                            self.report.reject(filename, reader.line_num, "empty_name", [raw])
+                        elif name in seen:
+                            self.report.reject(filename, reader.line_num, "duplicate_node", [raw])
+                        else:
+                            seen.add(name)
+                            names.append(name)
+                            self.report.accept(label)
+                nodes[label] = names
+            self._nodes = nodes
+        return self._nodes
+
+    def relations(self) -> Iterator[Tuple[str, str, str]]:
+        """逐行产出通过校验的 (head, relation, tail)"""
+        known = {label: set(names) for label, names in self.nodes().items()}
+        seen = set()
+        with open(os.path.join(self.data_dir, RELATION_FILE), "r", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                raw = [row.get("Column1") or "", row.get("Column2") or "", row.get("Column3") or ""]
+                head = self._normalize(raw[0])
+                tail = self._normalize(raw[1])
+                rel = normalize_name(raw[2])
+                if not head or not tail or not rel:
+                    reason = "empty_field"
+                elif rel not in RELATION_LABELS:
+                    reason = "unknown_relation"
+                elif head not in known[RELATION_LABELS[rel][0]]:
+                    reason = "missing_head"
+                elif tail not in known[RELATION_LABELS[rel][1]]:
+                    reason = "missing_tail"
+                elif (head, rel, tail) in seen:
+                    reason = "duplicate"
+                else:
+                    seen.add((head, rel, tail))
+                    self.report.accept("relations")
+                    yield head, rel, tail
+                    continue
+                self.report.reject(RELATION_FILE, reader.line_num, reason, raw)
+
+    def close(self):
+        self.report.close()
+
+
+def write_clean_csv(preflight: CsvPreflight, output_dir: str):
+    """把清洗后的节点和关系写成与原始文件同格式的 CSV"""
+    os.makedirs(output_dir, exist_ok=True)
+    nodes = preflight.nodes()
+    for filename, (label, column) in NODE_FILES.items():
+        with open(os.path.join(output_dir, filename), "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["id", column])
+            for i, name in enumerate(nodes[label], 1):
+                writer.writerow([i, name])
+    with open(os.path.join(output_dir, RELATION_FILE), "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "Column1", "Column2", "Column3"])
+        for i, (head, rel, tail) in enumerate(preflight.relations(), 1):
+            writer.writerow([i, head, tail, rel])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图数据导入前的 CSV 校验与去重")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--rejects", help="拒绝报告输出路径（CSV）")
+    parser.add_argument("--output-dir", help="写出清洗后的 CSV 到该目录")
+    args = parser.parse_args()
+
+    preflight = CsvPreflight(args.data_dir, rejects_path=args.rejects)
+    try:
+        if args.output_dir:
+            write_clean_csv(preflight, args.output_dir)
+        else:
+            for _ in preflight.relations():
+                pass
+    finally:
+        preflight.close()
+    print(preflight.report.summary())
+
+
+if __name__ == "__main__":
+    main()
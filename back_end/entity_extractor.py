@@ -6,13 +6,21 @@
 核心目标：准确抽取出如 ("七里香", "歌手", "周杰伦") 的结构化事实，
 以便与KG比对，检测幻觉。
 """
-from db import get_db, close_db
+from graph_backend import get_backend
+from cache import LRUCache
+from profiling import stage
+import itertools
+import os
 import re
 import subprocess
 import sys
 import json
+import threading
 from typing import List, Dict, Tuple
 
+# 词典版本号：每次（重新）加载实体词典递增，用于让依赖词典的缓存失效
+_dictionary_versions = itertools.count(1)
+
 
 # ==============================================================================
 # 🧠 类：MusicEntityExtractor —— 音乐领域实体词典加载与匹配器
@@ -23,44 +31,66 @@ from typing import List, Dict, Tuple
 class MusicEntityExtractor:
     """音乐领域实体抽取器"""
 
-    def __init__(self):
+    def __init__(self, backend=None):
         """
         初始化实体抽取器，从KG加载实体列表。
         加载三类实体：作品（歌曲）、专辑、人物。
+        backend 为分片自己的图后端（见 shards.py）；默认使用全局 get_backend()。
         """
+        self.backend = backend
         self.songs = set()  # 存储所有歌曲名（来自 :作品 节点）
         self.albums = set()  # 存储所有专辑名（来自 :专辑 节点）
         self.persons = set()  # 存储所有人物名（来自 :人物 节点）
+        self.version = 0  # 词典版本号，每次加载递增
+        self._first_char_index = None
+        self._reload_listeners = []
+        self._load_entities_from_kg()
+
+    def reload(self):
+        """重新从 KG 加载词典，并通知依赖词典的缓存失效"""
         self._load_entities_from_kg()
+        self._first_char_index = None
+        for listener in list(self._reload_listeners):
+            listener(self)
+
+    def on_reload(self, listener):
+        """注册词典重新加载后的回调 listener(extractor)"""
+        self._reload_listeners.append(listener)
+
+    @property
+    def first_char_index(self) -> Dict[str, List[str]]:
+        """首字 → 以该字开头的全部实体名（长的在前），供流式输出中增量匹配实体用"""
+        if self._first_char_index is None:
+            index = {}
+            for name in sorted(self.songs | self.albums | self.persons, key=len, reverse=True):
+                if name:
+                    index.setdefault(name[0], []).append(name)
+            self._first_char_index = index
+        return self._first_char_index
 
     def _load_entities_from_kg(self):
         """
-        【私有方法】从 Neo4j 知识图谱中加载全部实体。
-        执行三条 Cypher 查询，分别获取作品、专辑、人物的 name 属性。
+        【私有方法】从知识图谱后端（Neo4j / SQLite，见 graph_backend）中加载全部实体。
+        分别获取作品、专辑、人物的 name 属性。
         若连接失败，则清空集合，避免后续崩溃。
         """
         try:
-            db = get_db()
-            try:
-                with db.session() as session:
-                    result = session.run("MATCH (n:作品) RETURN n.name AS name")
-                    self.songs = {record["name"] for record in result}
-                    print(f"加载了 {len(self.songs)} 首歌曲")
-
-                    result = session.run("MATCH (n:专辑) RETURN n.name AS name")
-                    self.albums = {record["name"] for record in result}
-                    print(f"加载了 {len(self.albums)} 个专辑")
-
-                    result = session.run("MATCH (n:人物) RETURN n.name AS name")
-                    self.persons = {record["name"] for record in result}
-                    print(f"加载了 {len(self.persons)} 个人物")
-            finally:
-                close_db(db)
+            backend = self.backend or get_backend()
+            self.songs = set(backend.list_entities("作品"))
+            print(f"加载了 {len(self.songs)} 首歌曲")
+
+            self.albums = set(backend.list_entities("专辑"))
+            print(f"加载了 {len(self.albums)} 个专辑")
+
+            self.persons = set(backend.list_entities("人物"))
+            print(f"加载了 {len(self.persons)} 个人物")
+            self.version = next(_dictionary_versions)
         except Exception as e:
             print(f"警告: 加载实体列表时出错: {e}")
             self.songs = set()
             self.albums = set()
             self.persons = set()
+            self.version = next(_dictionary_versions)
 
     def extract_entities(self, text: str) -> Dict[str, List[str]]:
         """
@@ -171,25 +201,55 @@ def _extract_ungrounded_person_candidates(text: str, extractor: MusicEntityExtra
     return candidates
 
 
+# ==============================================================================
+# 📝 常量：抽取 Prompt —— 静态前缀（指令 + 示例，带版本号）+ 动态后缀（待抽取文本）
+# 前缀在每次调用中完全相同，stream 模式下只求值一次并复用（见 llm.generate_with_prefix）。
+# 修改前缀内容时请同时递增 EXTRACTION_PROMPT_VERSION。
+# ==============================================================================
+EXTRACTION_PROMPT_VERSION = "v1"
+
+EXTRACTION_PROMPT_PREFIX = """你是一个专业的信息抽取系统。请从以下文本中：
+1. 识别【歌曲】和【人物】实体；
+2. 判断它们之间的关系，关系类型只能是：歌手、作词、作曲；
+3. 输出严格为 JSON 列表，格式：[{"head":"歌曲","relation":"关系","tail":"人物"}]
+
+示例：
+文本：《青花瓷》由周杰伦演唱，方文山作词。
+输出：
+[{"head": "青花瓷", "relation": "歌手", "tail": "周杰伦"}, {"head": "青花瓷", "relation": "作词", "tail": "方文山"}]
+
+"""
+
+EXTRACTION_PROMPT_SUFFIX = """文本：{llm_answer}
+输出：
+"""
+
+
 # ==============================================================================
 # 🤖 函数：_call_llm_for_extraction —— 调用 LLM 执行结构化信息抽取
 # 作用：通过 Ollama 调用本地 LLM（如 qwen:7b），传入 Prompt，要求其输出 JSON。
-# 输入：Prompt 字符串
+# 输入：prompt 为动态后缀，prefix 为静态前缀（prefix_version 标识其版本）
 # 输出：LLM 返回的第一行非空文本（已清理 Thinking... 日志）
 # 注意：这是“让 LLM 自己做 NER+RE”的核心调用点。
+#       stream 模式走 HTTP 接口并复用前缀；cli 模式每次发送完整 Prompt。
 # ==============================================================================
-def _call_llm_for_extraction(prompt: str) -> str:
+def _call_llm_for_extraction(prompt: str, prefix: str = "", prefix_version: str = "") -> str:
     """内部函数：调用 LLM 执行抽取"""
+    from llm import LLM_MODE, LLM_MODEL, generate_with_prefix
     try:
-        result = subprocess.run(
-            ["ollama", "run", "qwen2.5:1.5b", prompt],
-            capture_output=True,
-            text=True,
-            timeout=60,
-            encoding='utf-8',
-            creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
-        )
-        output = result.stdout.strip()
+        if LLM_MODE == "stream":
+            output, _ = generate_with_prefix(prefix, prompt, prefix_version)
+            output = output.strip()
+        else:
+            result = subprocess.run(
+                ["ollama", "run", LLM_MODEL, prefix + prompt],
+                capture_output=True,
+                text=True,
+                timeout=60,
+                encoding='utf-8',
+                creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+            )
+            output = result.stdout.strip()
         output = re.sub(r'^Thinking\.\.\.\s*', '', output, flags=re.MULTILINE)
         output = re.sub(r'\.{3}done thinking.*$', '', output, flags=re.MULTILINE)
         return output.split('\n')[0].strip()
@@ -198,6 +258,35 @@ def _call_llm_for_extraction(prompt: str) -> str:
         return ""
 
 
+def _validate_llm_triples(
+    data,
+    extractor: MusicEntityExtractor,
+    allow_ungrounded: bool,
+    forced_head: str = ""
+) -> List[Tuple[str, str, str]]:
+    """校验 LLM 输出的 [{"head","relation","tail"}] 列表，只保留合法的三元组"""
+    triples = []
+    if not isinstance(data, list):
+        return triples
+    for item in data:
+        if not isinstance(item, dict):
+            continue
+        head = _normalize_entity(str(item.get("head", "")))
+        rel = str(item.get("relation", "")).strip()
+        tail = _normalize_entity(str(item.get("tail", "")))
+        if allow_ungrounded:
+            tail = _clean_tail_candidate(tail)
+        if allow_ungrounded and not head and forced_head:
+            head = forced_head
+        if rel in ALLOWED_RELATIONS:
+            if allow_ungrounded:
+                if head and _is_valid_tail(tail, extractor, allow_ungrounded=True):
+                    triples.append((head, rel, tail))
+            elif (head in extractor.songs or head in extractor.albums) and tail in extractor.persons:
+                triples.append((head, rel, tail))
+    return triples
+
+
 # ==============================================================================
 # 🧩 函数：extract_triples_from_llm_answer —— 主三元组抽取入口
 # 作用：从 LLM 的自然语言回答中，抽取出结构化三元组 [(head, relation, tail)]。
@@ -211,57 +300,89 @@ def _call_llm_for_extraction(prompt: str) -> str:
 def extract_triples_from_llm_answer(
     llm_answer: str,
     question: str = "",
-    allow_ungrounded: bool = False
+    allow_ungrounded: bool = False,
+    extractor: MusicEntityExtractor = None
 ) -> List[Tuple[str, str, str]]:
     if not llm_answer or llm_answer.strip().lower() in {"未知", "unknown", ""}:
         return []
 
-    extractor = get_entity_extractor()
+    from handler import extract_head_entity, get_relation_type_from_question
+    # 分片部署时传入问题所属分片的抽取器；词典版本号全局递增，不同分片的缓存键不会冲突
+    extractor = extractor or get_entity_extractor()
+    text = _normalize_answer_text(llm_answer)
+    key = (
+        text,
+        extract_head_entity(question) if question else "",
+        get_relation_type_from_question(question),
+        allow_ungrounded,
+        extractor.version,
+    )
+    cached = extraction_memo.get(key)
+    if cached is not None:
+        return list(cached)
+
+    # 规范化文本只用作缓存键，抽取仍使用原始回答
+    triples, path, llm_ok = _extract_triples_uncached(llm_answer, question, extractor, allow_ungrounded)
+    if llm_ok:
+        # LLM 调用失败（超时/出错）时的兜底结果不缓存，下次仍会重试 LLM
+        extraction_memo.put(key, triples, path)
+    return list(triples)
+
+
+def _extract_triples_uncached(
+    llm_answer: str,
+    question: str,
+    extractor: MusicEntityExtractor,
+    allow_ungrounded: bool
+) -> Tuple[List[Tuple[str, str, str]], str, bool]:
+    """
+    完整的抽取级联，返回 (triples, path, llm_ok)：path 为 llm / lightweight / regex；
+    llm_ok 为 False 表示 LLM 调用本身失败（没有任何输出），结果来自降级的规则兜底
+    """
     forced_head = ""
     if allow_ungrounded and question:
         from handler import extract_head_entity
         forced_head = extract_head_entity(question)
 
     # === 第一步：尝试用 LLM 抽取（主路径）===
-    extraction_prompt = f"""你是一个专业的信息抽取系统。请从以下文本中：
-1. 识别【歌曲】和【人物】实体；
-2. 判断它们之间的关系，关系类型只能是：歌手、作词、作曲；
-3. 输出严格为 JSON 列表，格式：[{{"head":"歌曲","relation":"关系","tail":"人物"}}]
-
-示例：
-文本：《青花瓷》由周杰伦演唱，方文山作词。
-输出：
-[{{"head": "青花瓷", "relation": "歌手", "tail": "周杰伦"}}, {{"head": "青花瓷", "relation": "作词", "tail": "方文山"}}]
-
-文本：{llm_answer}
-输出：
-"""
-
-    raw_output = _call_llm_for_extraction(extraction_prompt)
-    triples = []
+    with stage("extract_llm_call"):
+        raw_output = _call_llm_for_extraction(
+            EXTRACTION_PROMPT_SUFFIX.format(llm_answer=llm_answer),
+            prefix=EXTRACTION_PROMPT_PREFIX,
+            prefix_version=EXTRACTION_PROMPT_VERSION
+        )
     try:
-        json_match = re.search(r'(\[.*\])', raw_output, re.DOTALL)
-        if json_match:
-            data = json.loads(json_match.group(1))
-            for item in data:
-                head = _normalize_entity(item.get("head", ""))
-                rel = item.get("relation", "").strip()
-                tail = _normalize_entity(item.get("tail", ""))
-                if allow_ungrounded:
-                    tail = _clean_tail_candidate(tail)
-                if allow_ungrounded and not head and forced_head:
-                    head = forced_head
-                if rel in ALLOWED_RELATIONS:
-                    if allow_ungrounded:
-                        if head and _is_valid_tail(tail, extractor, allow_ungrounded=True):
-                            triples.append((head, rel, tail))
-                    elif (head in extractor.songs or head in extractor.albums) and tail in extractor.persons:
-                        triples.append((head, rel, tail))
+        with stage("extract_json_parse"):
+            json_match = re.search(r'(\[.*\])', raw_output, re.DOTALL)
+            triples = _validate_llm_triples(
+                json.loads(json_match.group(1)), extractor, allow_ungrounded, forced_head
+            ) if json_match else []
         if triples:
-            return triples
+            return triples, "llm", True
     except Exception as e:
         print(f"[LLM EXTRACTION FAILED] {e}. Trying fallback...")
 
+    with stage("extract_rules"):
+        triples, path = _rule_based_extraction_with_path(llm_answer, question, extractor, allow_ungrounded)
+    return triples, path, bool(raw_output)
+
+
+def _rule_based_extraction(
+    llm_answer: str,
+    question: str,
+    extractor: MusicEntityExtractor,
+    allow_ungrounded: bool
+) -> List[Tuple[str, str, str]]:
+    """LLM 抽取失败后的两级规则兜底：轻量规则 → 关键词正则"""
+    return _rule_based_extraction_with_path(llm_answer, question, extractor, allow_ungrounded)[0]
+
+
+def _rule_based_extraction_with_path(
+    llm_answer: str,
+    question: str,
+    extractor: MusicEntityExtractor,
+    allow_ungrounded: bool
+) -> Tuple[List[Tuple[str, str, str]], str]:
     # === 第二步：LLM 失败 → 启用轻量规则抽取 ===
     print("[INFO] Fallback to lightweight extraction.")
     light_triples = _lightweight_extraction(
@@ -271,7 +392,7 @@ def extract_triples_from_llm_answer(
         allow_ungrounded=allow_ungrounded
     )
     if light_triples:
-        return light_triples
+        return light_triples, "lightweight"
 
     # === 第三步：再走关键词兜底 ===
     print("[INFO] Fallback to regex-based extraction.")
@@ -279,7 +400,60 @@ def extract_triples_from_llm_answer(
         llm_answer,
         extractor,
         allow_ungrounded=allow_ungrounded
-    )
+    ), "regex"
+
+
+# ==============================================================================
+# 🗂️ 类：ExtractionMemo —— 三元组抽取结果的有界缓存
+# 作用：不同问题经常得到完全相同的 LLM 回答（如“周杰伦”“方文山”），
+#       相同输入无需重复跑 LLM → 轻量规则 → 正则 的整条级联。
+# 键：(规范化后的回答文本, 问题中的 head 实体, 关系类型, allow_ungrounded, 词典版本)
+# 统计：按产生结果的抽取路径（llm / lightweight / regex）分别记录命中与未命中。
+# 失效：词典重新加载时版本号变化，且整个缓存被清空。
+# LLM 调用失败（超时/出错）时的兜底结果不进入缓存，避免一次故障把降级结果固定下来。
+# ==============================================================================
+EXTRACTION_CACHE_SIZE = int(os.getenv("EXTRACTION_CACHE_SIZE", "4096"))
+
+
+class ExtractionMemo:
+    def __init__(self, maxsize: int = EXTRACTION_CACHE_SIZE):
+        self._cache = LRUCache(maxsize)
+        self._lock = threading.Lock()
+        self.path_stats = {}
+
+    def _count(self, path: str, field: str):
+        with self._lock:
+            stats = self.path_stats.setdefault(path, {"hits": 0, "misses": 0})
+            stats[field] += 1
+
+    def get(self, key):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        triples, path = entry
+        self._count(path, "hits")
+        return triples
+
+    def put(self, key, triples, path: str):
+        self._count(path, "misses")
+        self._cache.put(key, (tuple(triples), path))
+
+    def clear(self, *_):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            paths = {path: dict(stats) for path, stats in self.path_stats.items()}
+        return dict(self._cache.stats(), paths=paths)
+
+
+extraction_memo = ExtractionMemo()
+
+
+def _normalize_answer_text(text: str) -> str:
+    """去掉首尾和行内多余空白、空行，只作为缓存键（实际抽取使用原始回答）"""
+    lines = [re.sub(r"[ \t\u3000]+", " ", line).strip() for line in text.strip().split("\n")]
+    return "\n".join(line for line in lines if line)
 
 
 # ==============================================================================
@@ -398,6 +572,47 @@ def _fallback_regex_extraction(
     return triples
 
 
+# ==============================================================================
+# 🎯 函数：parse_answer_and_triples —— 单次调用模式的输出解析
+# 作用：LLM 用一个结构化 Prompt 同时给出回答和三元组，
+#       输出形如 {"answer": "方文山", "triples": [{"head": ..., "relation": ..., "tail": ...}]}。
+# 输出格式不合法时：回答取原始文本，三元组走轻量规则 / 关键词兜底。
+# 返回：(answer, triples, path)，path 为 "single_pass" 或 "fallback"
+# ==============================================================================
+def parse_answer_and_triples(
+    raw_output: str,
+    question: str = "",
+    allow_ungrounded: bool = False,
+    extractor: MusicEntityExtractor = None
+) -> Tuple[str, List[Tuple[str, str, str]], str]:
+    from llm import parse_llm_answer
+
+    extractor = extractor or get_entity_extractor()
+    forced_head = ""
+    if allow_ungrounded and question:
+        from handler import extract_head_entity
+        forced_head = extract_head_entity(question)
+
+    try:
+        json_match = re.search(r'(\{.*\})', raw_output or "", re.DOTALL)
+        if json_match:
+            data = json.loads(json_match.group(1))
+            answer = data.get("answer") if isinstance(data, dict) else None
+            if isinstance(answer, str) and answer.strip():
+                answer = parse_llm_answer(answer)
+                triples = _validate_llm_triples(data.get("triples"), extractor, allow_ungrounded, forced_head)
+                if not triples and answer != "未知":
+                    triples = _rule_based_extraction(answer, question, extractor, allow_ungrounded)
+                return answer, triples, "single_pass"
+    except Exception as e:
+        print(f"[SINGLE PASS PARSE FAILED] {e}. Trying fallback...")
+
+    answer = parse_llm_answer(raw_output or "")
+    if answer == "未知":
+        return answer, [], "fallback"
+    return answer, _rule_based_extraction(answer, question, extractor, allow_ungrounded), "fallback"
+
+
 # ==============================================================================
 # 🧾 函数：get_entity_extractor —— 单例模式获取实体抽取器
 # 作用：全局只加载一次 KG 实体，避免重复连接数据库。
@@ -411,4 +626,12 @@ def get_entity_extractor() -> MusicEntityExtractor:
     global _extractor_instance
     if _extractor_instance is None:
         _extractor_instance = MusicEntityExtractor()
+        _extractor_instance.on_reload(extraction_memo.clear)
     return _extractor_instance
+
+
+def reload_entity_extractor() -> MusicEntityExtractor:
+    """重新加载实体词典（如图数据重新导入之后），依赖词典的缓存随之失效"""
+    extractor = get_entity_extractor()
+    extractor.reload()
+    return extractor
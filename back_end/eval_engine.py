@@ -0,0 +1,480 @@
+# coding=utf-8
+"""
+大规模评估引擎：流式读取用例、缓存系统输出、按批向量化计算指标、与基线对比。
+
+与 evaluate.py 的指标定义一致（Answer F1 / Hits@1 / HDR / 错误分类 / 按关系 F1），区别在于：
+  - 用例从 JSONL 流式读取，按批（--batch-size）处理，不整体载入内存
+  - 系统输出缓存在 SQLite（eval_cache.sqlite3）中，键为 问题 + 代码版本 + 图数据版本 + 相关配置；
+    代码和图数据都没变时直接复用上次的输出，不再调用系统。
+    /query_v2 的输出含 LLM 生成结果，复用会掩盖 LLM 的随机波动，因此默认不缓存，需显式 --reuse-llm-outputs；
+    复用时报告中会标明命中条数
+  - 每批的 F1、Hits@1、HDR 用 NumPy 在整批上一次算出（分词仍沿用 evaluate.normalize_answer）
+  - 逐题得分按用例序号（同一问题出现多次时各自计分）在每批算完后立即写出到文件，不在内存中累积
+  - --save-baseline 保存本次结果；--baseline 给出汇总指标的差值和逐题回退/提升（按序号逐行流式比较）
+
+基线文件为 JSONL：首行 {"summary": {...}}，其后每行 {"index": 序号, "question": 问题, "f1": 得分}。
+
+用法：
+    python eval_engine.py cases.jsonl --save-baseline baseline.json
+    python eval_engine.py cases.jsonl --baseline baseline.json --workers 8
+    python eval_engine.py test_cases.json --endpoint query_v2 --output results.csv
+"""
+import argparse
+import contextlib
+import csv
+import glob
+import hashlib
+import heapq
+import json
+import os
+import sqlite3
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Dict, Iterator, List
+
+import numpy as np
+
+from evaluate import get_relation_type, iter_test_cases, normalize_answer, query_v2_answers, question_matched
+
+BACK_END_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_PATH = os.path.join(BACK_END_DIR, "eval_cache.sqlite3")
+DEFAULT_BATCH_SIZE = 2048
+
+# 不影响系统输出的脚本，不计入代码版本
+CODE_VERSION_EXCLUDE = ("eval_engine.py", "evaluate.py", "evaluate_single_pass.py", "loadtest.py")
+CODE_VERSION_EXCLUDE_PREFIXES = ("benchmark_",)
+# 会影响系统输出的配置项（环境变量前缀）
+CONFIG_ENV_PREFIXES = ("KG_", "ROUTER_", "LLM_", "QA_", "EXTRACTION_")
+CONFIG_ENV_EXCLUDE = ("KG_PROFILING", "KG_PROFILING_TOKEN", "KG_WORKERS")
+
+ERROR_TYPES = ("pattern_mismatch", "kg_missing", "correct", "wrong_retrieval")
+RELATION_TYPES = ("歌手", "作词")
+
+
+# ==============================================================================
+# 版本：代码版本 = 后端源码摘要；图数据版本 = graph_backend.graph_version()
+# ==============================================================================
+def code_version() -> str:
+    digest = hashlib.sha1()
+    files = sorted(glob.glob(os.path.join(BACK_END_DIR, "*.py")))
+    for path in files:
+        name = os.path.basename(path)
+        if name in CODE_VERSION_EXCLUDE or name.startswith(CODE_VERSION_EXCLUDE_PREFIXES):
+            continue
+        if os.path.exists(path):
+            digest.update(name.encode("utf-8"))
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def config_fingerprint(endpoint: str) -> str:
+    items = sorted(
+        (k, v) for k, v in os.environ.items()
+        if k.startswith(CONFIG_ENV_PREFIXES) and k not in CONFIG_ENV_EXCLUDE
+    )
+    return json.dumps([endpoint, items], ensure_ascii=False)
+
+
+# ==============================================================================
+# 系统输出缓存
+# ==============================================================================
+class OutputCache:
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS outputs (key TEXT PRIMARY KEY, output TEXT NOT NULL)")
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys: List[str]) -> Dict[str, dict]:
+        found = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT key, output FROM outputs WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            )
+            found.update((key, json.loads(output)) for key, output in rows)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Dict[str, dict]):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO outputs (key, output) VALUES (?, ?)",
+                ((key, json.dumps(output, ensure_ascii=False)) for key, output in items.items())
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+def make_system(endpoint: str):
+    """返回 question -> {"final": 最终答案字符串, "answers": 答案列表, "state": 0/1}"""
+    if endpoint == "query":
+        from handler import query_all
+
+        def run(question):
+            res = query_all(question)
+            answers = res["data"] if res["state"] == 0 else []
+            return {"final": ", ".join(answers), "answers": answers, "state": res["state"]}
+        return run
+
+    from two_stage import two_stage_qa
+
+    def run(question):
+        res = two_stage_qa(question)
+        answers = query_v2_answers(res)
+        return {"final": res["final_answer"], "answers": answers, "state": 0}
+    return run
+
+
+# ==============================================================================
+# 向量化指标
+# ==============================================================================
+class Vocabulary:
+    """字符串 → 整数 id，供按批构造 NumPy 数组"""
+
+    def __init__(self):
+        self.ids = {}
+
+    def encode(self, items) -> List[int]:
+        ids = self.ids
+        return [ids.setdefault(item, len(ids)) for item in items]
+
+
+def _grouped_keys(groups: List[List[int]], width: int) -> np.ndarray:
+    """把每条用例的 id 集合编码成 (用例下标 * width + id) 的去重有序数组"""
+    lengths = np.fromiter((len(g) for g in groups), dtype=np.int64, count=len(groups))
+    owners = np.repeat(np.arange(len(groups), dtype=np.int64), lengths)
+    ids = np.fromiter((i for g in groups for i in g), dtype=np.int64, count=int(lengths.sum()))
+    return np.unique(owners * width + ids)
+
+
+def _set_stats(left: List[List[int]], right: List[List[int]], width: int):
+    """逐条用例的 |L|、|R|、|L ∩ R|（集合语义）"""
+    n = len(left)
+    left_keys = _grouped_keys(left, width)
+    right_keys = _grouped_keys(right, width)
+    common = np.intersect1d(left_keys, right_keys, assume_unique=True)
+    return (
+        np.bincount(left_keys // width, minlength=n),
+        np.bincount(right_keys // width, minlength=n),
+        np.bincount(common // width, minlength=n),
+    )
+
+
+def score_batch(cases: List[dict], outputs: List[dict], vocab: Vocabulary) -> Dict[str, np.ndarray]:
+    """一批用例的逐条指标（数组）；定义与 evaluate.evaluate() 相同"""
+    pred_tokens, gold_tokens = [], []
+    pred_answers, gold_answers, gold_lower, llm_tokens = [], [], [], []
+    for case, output in zip(cases, outputs):
+        golden = case["golden_answer"]
+        pred_tokens.append(vocab.encode(normalize_answer(output["final"])))
+        gold_tokens.append(vocab.encode(normalize_answer(" ".join(golden))))
+        pred_answers.append(vocab.encode(output["answers"]))
+        gold_answers.append(vocab.encode(golden))
+        gold_lower.append(vocab.encode(g.lower() for g in golden))
+        llm_tokens.append(vocab.encode(normalize_answer(case.get("llm_answer", ""))))
+    width = len(vocab.ids) + 1
+
+    # Answer F1（token 集合）
+    n_pred, n_gold, n_common = _set_stats(pred_tokens, gold_tokens, width)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(n_pred > 0, n_common / np.maximum(n_pred, 1), 0.0)
+        recall = np.where(n_gold > 0, n_common / np.maximum(n_gold, 1), 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    f1 = np.where(n_gold == 0, (n_pred == 0).astype(float), f1)
+
+    # Hits@1 与“系统答案覆盖全部标准答案”（答案集合）
+    a_pred, a_gold, a_common = _set_stats(pred_answers, gold_answers, width)
+    hit = a_common > 0
+    covers_gold = a_common == a_gold
+
+    # HDR 分母：LLM 回答的 token 集合没有覆盖全部（小写）标准答案
+    _, l_gold, l_common = _set_stats(llm_tokens, gold_lower, width)
+    llm_wrong = l_common < l_gold
+
+    matched = np.fromiter((question_matched(c["question"]) for c in cases), dtype=bool, count=len(cases))
+    error = np.where(
+        ~matched, 0,
+        np.where(a_pred == 0, 1, np.where((a_common == a_pred) & (a_common == a_gold), 2, 3))
+    )
+    return {
+        "f1": f1,
+        "hit": hit,
+        "llm_wrong": llm_wrong,
+        "hdr_fixed": llm_wrong & covers_gold,
+        "error": error,
+    }
+
+
+class Aggregate:
+    def __init__(self):
+        self.total = 0
+        self.f1_sum = 0.0
+        self.hits = 0
+        self.hdr_num = 0
+        self.hdr_den = 0
+        self.errors = np.zeros(len(ERROR_TYPES), dtype=np.int64)
+        self.relation_f1 = {rel: [0.0, 0] for rel in RELATION_TYPES}
+
+    def add(self, cases, scores):
+        self.total += len(cases)
+        self.f1_sum += float(scores["f1"].sum())
+        self.hits += int(scores["hit"].sum())
+        self.hdr_den += int(scores["llm_wrong"].sum())
+        self.hdr_num += int(scores["hdr_fixed"].sum())
+        self.errors += np.bincount(scores["error"], minlength=len(ERROR_TYPES))
+        relations = np.array([get_relation_type(c["question"]) for c in cases])
+        for rel in RELATION_TYPES:
+            mask = relations == rel
+            self.relation_f1[rel][0] += float(scores["f1"][mask].sum())
+            self.relation_f1[rel][1] += int(mask.sum())
+
+    def summary(self) -> dict:
+        total = max(self.total, 1)
+        return {
+            "cases": self.total,
+            "answer_f1": self.f1_sum / total * 100,
+            "hits_at_1": self.hits / total * 100,
+            "hdr": self.hdr_num / self.hdr_den * 100 if self.hdr_den else 0.0,
+            "errors": {name: int(count) for name, count in zip(ERROR_TYPES, self.errors)},
+            "relation_f1": {
+                rel: (s / c * 100 if c else 0.0) for rel, (s, c) in self.relation_f1.items()
+            },
+        }
+
+
+# ==============================================================================
+# 运行
+# ==============================================================================
+def batched(items: Iterator[dict], size: int) -> Iterator[List[dict]]:
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def case_key(question: str, versions: str) -> str:
+    return hashlib.sha1(f"{versions}\n{question}".encode("utf-8")).hexdigest()
+
+
+def run(path, endpoint="query", batch_size=DEFAULT_BATCH_SIZE, workers=1, cache=None,
+        limit=None, output_path=None, cases_path=None, verbose=False):
+    """
+    cases_path: 逐题得分的 JSONL 输出路径（每批算完即写出），供基线对比/保存使用
+    返回汇总指标
+    """
+    from graph_backend import graph_version
+
+    versions = f"{code_version()}|{graph_version()}|{config_fingerprint(endpoint)}"
+    system = make_system(endpoint)
+    aggregate = Aggregate()
+    vocab = Vocabulary()
+    called = 0
+    reused = 0
+    index = 0
+    start = time.perf_counter()
+
+    writer = None
+    out_file = None
+    if output_path:
+        out_file = open(output_path, "w", encoding="utf-8-sig", newline="")
+        writer = csv.writer(out_file)
+        writer.writerow(["index", "question", "golden_answer", "llm_answer", "system_answer",
+                         "f1_score", "error_type", "relation_type"])
+    cases_file = open(cases_path, "w", encoding="utf-8") if cases_path else None
+
+    cases_iter = iter_test_cases(path)
+    if limit:
+        cases_iter = islice(cases_iter, limit)
+    pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    quiet = open(os.devnull, "w") if not verbose else None
+    try:
+        for cases in batched(cases_iter, batch_size):
+            keys = [case_key(c["question"], versions) for c in cases]
+            outputs = cache.get_many(keys) if cache is not None else {}
+            reused += len(outputs)
+            missing = [(k, c["question"]) for k, c in zip(keys, cases) if k not in outputs]
+            if missing:
+                with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+                    if pool is not None:
+                        computed = list(pool.map(lambda item: system(item[1]), missing))
+                    else:
+                        computed = [system(q) for _, q in missing]
+                fresh = {k: out for (k, _), out in zip(missing, computed)}
+                called += len(fresh)
+                outputs.update(fresh)
+                if cache is not None:
+                    cache.put_many(fresh)
+            batch_outputs = [outputs[k] for k in keys]
+
+            scores = score_batch(cases, batch_outputs, vocab)
+            aggregate.add(cases, scores)
+            if cases_file is not None:
+                for offset, (case, f1) in enumerate(zip(cases, scores["f1"])):
+                    row = {"index": index + offset, "question": case["question"], "f1": round(float(f1), 4)}
+                    cases_file.write(json.dumps(row, ensure_ascii=False) + "\n")
+            if writer is not None:
+                for offset, (case, output, f1, err) in enumerate(
+                        zip(cases, batch_outputs, scores["f1"], scores["error"])):
+                    writer.writerow([
+                        index + offset, case["question"], "; ".join(case["golden_answer"]),
+                        case.get("llm_answer", ""), "; ".join(output["answers"]), round(float(f1), 4),
+                        ERROR_TYPES[err], get_relation_type(case["question"]),
+                    ])
+            index += len(cases)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if quiet is not None:
+            quiet.close()
+        if out_file is not None:
+            out_file.close()
+        if cases_file is not None:
+            cases_file.close()
+
+    summary = aggregate.summary()
+    summary["elapsed_s"] = time.perf_counter() - start
+    summary["system_calls"] = called
+    summary["reused_outputs"] = reused
+    summary["llm_outputs_reused"] = endpoint == "query_v2" and reused > 0
+    summary["versions"] = versions.split("|")[:2]
+    return summary
+
+
+def diff_against_baseline(summary: dict, cases_path: str, baseline_path: str, top: int = 10) -> dict:
+    """逐行流式比较本次与基线的逐题得分：同一序号且问题相同的用例才参与比较"""
+    compared = regressed = improved = new_cases = 0
+    worst = []
+    with open(baseline_path, "r", encoding="utf-8") as base, open(cases_path, "r", encoding="utf-8") as current:
+        base_summary = json.loads(next(base))["summary"]
+        base_rows = (json.loads(line) for line in base)
+        for line in current:
+            row = json.loads(line)
+            before = next(base_rows, None)
+            if before is None or before["index"] != row["index"] or before["question"] != row["question"]:
+                new_cases += 1
+                continue
+            compared += 1
+            change = row["f1"] - before["f1"]
+            if change < 0:
+                regressed += 1
+                item = (-change, row["index"], row["question"], before["f1"], row["f1"])
+                if len(worst) < top:
+                    heapq.heappush(worst, item)
+                else:
+                    heapq.heappushpop(worst, item)
+            elif change > 0:
+                improved += 1
+
+    deltas = {
+        key: summary[key] - base_summary[key] for key in ("answer_f1", "hits_at_1", "hdr")
+    }
+    deltas["errors"] = {
+        name: summary["errors"][name] - base_summary["errors"].get(name, 0) for name in ERROR_TYPES
+    }
+    return {
+        "deltas": deltas,
+        "compared": compared,
+        "regressed": regressed,
+        "improved": improved,
+        "new_cases": new_cases,
+        "worst_regressions": [item[1:] for item in sorted(worst, reverse=True)],
+    }
+
+
+def save_baseline(summary: dict, cases_path: str, baseline_path: str):
+    """首行写汇总，其后原样拷贝逐题得分；先写临时文件再替换，基线与输出可为同一路径"""
+    tmp_path = baseline_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as out, open(cases_path, "r", encoding="utf-8") as rows:
+        out.write(json.dumps({"summary": summary}, ensure_ascii=False) + "\n")
+        shutil.copyfileobj(rows, out)
+    os.replace(tmp_path, baseline_path)
+
+
+def print_summary(summary: dict, cache: OutputCache = None):
+    print(f"用例: {summary['cases']}，系统调用: {summary['system_calls']}，耗时 {summary['elapsed_s']:.1f}s"
+          f"（代码版本 {summary['versions'][0]}，图数据版本 {summary['versions'][1]}）")
+    if cache is not None:
+        print(f"输出缓存: 命中 {cache.hits}，未命中 {cache.misses}")
+    if summary.get("llm_outputs_reused"):
+        print(f"   ⚠ {summary['reused_outputs']} 条 /query_v2 输出复用自缓存，LLM 的随机波动未被重新评估")
+    print(f"   • Answer F1 Score : {summary['answer_f1']:6.2f}%")
+    print(f"   • KG Hits@1       : {summary['hits_at_1']:6.2f}%")
+    print(f"   • Hallucination Correction Rate (HDR): {summary['hdr']:6.2f}%")
+    total = max(summary["cases"], 1)
+    for name, count in summary["errors"].items():
+        print(f"   • {name:20s}: {count} ({count / total * 100:5.1f}%)")
+    for rel, f1 in summary["relation_f1"].items():
+        print(f"   • {rel:4s} F1: {f1:6.2f}%")
+
+
+def print_diff(diff: dict):
+    d = diff["deltas"]
+    print(f"\n与基线对比（共同用例 {diff['compared']}，新增 {diff['new_cases']}）:")
+    print(f"   • Answer F1 {d['answer_f1']:+.2f}  Hits@1 {d['hits_at_1']:+.2f}  HDR {d['hdr']:+.2f}")
+    print("   • 错误类型变化: " + ", ".join(f"{k} {v:+d}" for k, v in d["errors"].items()))
+    print(f"   • 逐题 F1：下降 {diff['regressed']}，提升 {diff['improved']}")
+    for index, question, before, after in diff["worst_regressions"]:
+        print(f"     - #{index} {question}: {before:.2f} → {after:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="大规模评估：流式用例、输出缓存、向量化指标、基线对比")
+    parser.add_argument("cases", nargs="?", default="test_cases.json", help="用例文件（.jsonl 流式读取，或 .json 数组）")
+    parser.add_argument("--endpoint", choices=["query", "query_v2"], default="query")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=1, help="未命中缓存时并发调用系统的线程数")
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="系统输出缓存路径")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--reuse-llm-outputs", action="store_true",
+                        help="--endpoint query_v2 时也复用缓存的输出（默认每次重新调用 LLM）")
+    parser.add_argument("--output", help="写出逐条结果 CSV")
+    parser.add_argument("--baseline", help="与该基线文件对比")
+    parser.add_argument("--save-baseline", help="把本次结果保存为基线")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出汇总")
+    parser.add_argument("--verbose", action="store_true", help="保留系统自身的日志输出")
+    args = parser.parse_args()
+
+    use_cache = not args.no_cache and (args.endpoint == "query" or args.reuse_llm_outputs)
+    cache = OutputCache(args.cache) if use_cache else None
+    fd, cases_path = tempfile.mkstemp(prefix="eval_cases_", suffix=".jsonl")
+    os.close(fd)
+    try:
+        try:
+            summary = run(
+                args.cases, endpoint=args.endpoint, batch_size=args.batch_size, workers=args.workers,
+                cache=cache, limit=args.limit, output_path=args.output, cases_path=cases_path,
+                verbose=args.verbose
+            )
+        finally:
+            if cache is not None:
+                cache.close()
+
+        diff = diff_against_baseline(summary, cases_path, args.baseline) if args.baseline else None
+        if args.json:
+            json.dump({"summary": summary, "diff": diff}, sys.stdout, ensure_ascii=False, indent=2)
+            print()
+        else:
+            print_summary(summary, cache)
+            if diff is not None:
+                print_diff(diff)
+        if args.save_baseline:
+            save_baseline(summary, cases_path, args.save_baseline)
+            print(f"\n基线已保存至: {args.save_baseline}")
+    finally:
+        os.remove(cases_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,11 +3,27 @@ import json
 import re
 import csv
 from collections import defaultdict
-from handler import query_handler
-from typing import List
+from handler import query_all
+from typing import Iterator, List
+
+TEST_CASES_PATH = "test_cases.json"
+
+
+def iter_test_cases(path: str = TEST_CASES_PATH) -> Iterator[dict]:
+    """逐条读取测试用例：.jsonl 每行一条（流式，适合大规模用例集），其余按 JSON 数组整体读取"""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        else:
+            yield from json.load(f)
+
+
+def load_test_cases(path: str = TEST_CASES_PATH) -> List[dict]:
+    return list(iter_test_cases(path))
 
-with open("test_cases.json", "r", encoding="utf-8") as f:
-    TEST_CASES = json.load(f)
 
 def normalize_answer(text: str) -> set:
     if not text:
@@ -27,6 +43,14 @@ def answer_f1(pred: str, gold: List[str]) -> float:
     recall = len(common) / len(gold_tokens)
     return 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
 
+def is_hit_at_1(system_ans: List[str], gold: List[str]) -> bool:
+    """系统答案列表与标准答案集合有交集（逐个答案精确匹配，不做子串匹配）"""
+    return bool(system_ans) and bool(set(system_ans) & set(gold))
+
+def query_v2_answers(res: dict) -> List[str]:
+    """/query_v2 响应的答案列表：KG 答案优先，否则为最终回答"""
+    return res["kg_answers"] or ([res["final_answer"]] if res["final_answer"] else [])
+
 def classify_error(question: str, golden: List[str], system_pred: List[str], matched: bool) -> str:
     if not matched:
         return "pattern_mismatch"
@@ -36,6 +60,16 @@ def classify_error(question: str, golden: List[str], system_pred: List[str], mat
         return "correct"
     return "wrong_retrieval"
 
+def question_matched(question: str) -> bool:
+    """判断是否匹配成功（模拟 handler 内部逻辑）"""
+    return any([
+        re.search(r"歌曲(.+)的作词人是", question),
+        re.search(r"(.+)是谁唱的", question),
+        re.search(r"谁唱的(.+)", question),
+        re.search(r"谁作词的(.+)", question),
+        re.search(r"(.+)是哪个专辑的", question),  # 新增专辑 pattern
+    ])
+
 def get_relation_type(question: str) -> str:
     if "作词" in question:
         return "作词"
@@ -44,8 +78,9 @@ def get_relation_type(question: str) -> str:
     else:
         return "其他"
 
-def evaluate():
-    total = len(TEST_CASES)
+def evaluate(path: str = TEST_CASES_PATH):
+    test_cases = load_test_cases(path)
+    total = len(test_cases)
     f1_total = 0.0
     hits_at_1 = 0
     hdr_numerator = 0
@@ -57,33 +92,27 @@ def evaluate():
     # 存储每条结果用于写入 CSV
     results_rows = []
 
-    for test_case in TEST_CASES:
+    for test_case in test_cases:
         question = test_case["question"]
         golden = test_case["golden_answer"]
         llm_ans = test_case["llm_answer"]
 
         # 调用你的系统
-        print(f"\n[评估中] 调用 query_handler 处理问题: {question}")
-        res = query_handler(question)
+        print(f"\n[评估中] 调用 query_all 处理问题: {question}")
+        res = query_all(question)
         print(f"[评估中] 返回结果: {res}")
         system_ans = res["data"] if res["state"] == 0 else []
         final_str = ", ".join(system_ans)
 
         # 判断是否匹配成功（模拟 handler 内部逻辑）
-        matched = any([
-            re.search(r"歌曲(.+)的作词人是", question),
-            re.search(r"(.+)是谁唱的", question),
-            re.search(r"谁唱的(.+)", question),
-            re.search(r"谁作词的(.+)", question),
-            re.search(r"(.+)是哪个专辑的", question),  # 新增专辑 pattern
-        ])
+        matched = question_matched(question)
 
         # Answer F1
         f1 = answer_f1(final_str, golden)
         f1_total += f1
 
         # Hits@1
-        if system_ans and set(system_ans) & set(golden):
+        if is_hit_at_1(system_ans, golden):
             hits_at_1 += 1
 
         # HDR
@@ -0,0 +1,164 @@
+# evaluate_single_pass.py
+"""
+比较 /query_v2 的两种 LLM 调用方式：
+  - two_call   ：call_llm 生成回答 + extract_triples_from_llm_answer 再调用一次抽取三元组
+  - single_pass：一个结构化 Prompt 同时返回回答和三元组
+
+指标沿用 evaluate.py：Answer F1、Hits@1（与 eval_engine 的 /query_v2 评估同一定义，答案列表精确匹配），另加三元组 P/R/F1（对比 golden_triples）、
+每题 LLM 调用次数和端到端延迟。
+
+用法：
+    python evaluate_single_pass.py                    # 需要 Ollama 和图后端
+    python evaluate_single_pass.py --limit 20 --stub-graph
+"""
+import argparse
+import csv
+import statistics
+import time
+from contextlib import redirect_stdout
+import os
+
+from evaluate import answer_f1, is_hit_at_1, load_test_cases, query_v2_answers
+
+
+class CallCounter:
+    """包装 LLM 调用函数并计数"""
+
+    def __init__(self):
+        self.count = 0
+
+    def wrap(self, fn):
+        def wrapped(*args, **kwargs):
+            self.count += 1
+            return fn(*args, **kwargs)
+        return wrapped
+
+
+def triple_prf(pred, gold):
+    pred = {tuple(t) for t in pred}
+    gold = {tuple(t) for t in gold}
+    if not pred and not gold:
+        return 1.0, 1.0, 1.0
+    common = len(pred & gold)
+    p = common / len(pred) if pred else 0.0
+    r = common / len(gold) if gold else 0.0
+    f1 = 2 * p * r / (p + r) if p + r > 0 else 0.0
+    return p, r, f1
+
+
+def reset_caches():
+    """清空三元组抽取缓存和 Prompt 前缀缓存，避免上一种模式（或上一题）的结果让本题少调用 LLM"""
+    from entity_extractor import extraction_memo
+    from llm import prefix_cache
+    extraction_memo.clear()
+    prefix_cache.clear()
+
+
+def run_mode(cases, single_pass, counter, quiet=True):
+    from entity_extractor import extraction_memo
+    from two_stage import two_stage_qa
+
+    reset_caches()
+    rows = []
+    for case in cases:
+        # 每题都清空抽取缓存，使 llm_calls / 延迟反映单个问题的实际开销；前缀缓存在同一模式内保留
+        extraction_memo.clear()
+        counter.count = 0
+        start = time.perf_counter()
+        if quiet:
+            with open(os.devnull, "w", encoding="utf-8") as devnull, redirect_stdout(devnull):
+                res = two_stage_qa(case["question"], single_pass=single_pass)
+        else:
+            res = two_stage_qa(case["question"], single_pass=single_pass)
+        latency = time.perf_counter() - start
+
+        golden = case["golden_answer"]
+        p, r, f1 = triple_prf(res["stage_2_extracted_triples"], case.get("golden_triples", []))
+        rows.append({
+            "question": case["question"],
+            "mode": "single_pass" if single_pass else "two_call",
+            "final_answer": res["final_answer"],
+            "llm_answer": res["llm_answer"],
+            "answer_f1": answer_f1(res["final_answer"], golden),
+            "llm_answer_f1": answer_f1(res["llm_answer"], golden),
+            "hit": int(is_hit_at_1(query_v2_answers(res), golden)),
+            "triple_p": p,
+            "triple_r": r,
+            "triple_f1": f1,
+            "llm_calls": counter.count,
+            "latency_ms": latency * 1000,
+            "extraction_path": res.get("extraction_path", ""),
+        })
+    return rows
+
+
+def summarize(rows):
+    n = len(rows)
+    lat = sorted(r["latency_ms"] for r in rows)
+    return {
+        "answer_f1": sum(r["answer_f1"] for r in rows) / n * 100,
+        "llm_answer_f1": sum(r["llm_answer_f1"] for r in rows) / n * 100,
+        "hits_at_1": sum(r["hit"] for r in rows) / n * 100,
+        "triple_f1": sum(r["triple_f1"] for r in rows) / n * 100,
+        "llm_calls": sum(r["llm_calls"] for r in rows) / n,
+        "latency_mean": statistics.mean(lat),
+        "latency_p50": lat[n // 2],
+        "latency_p95": lat[max(0, int(n * 0.95) - 1)],
+        "fallback_rate": sum(r["extraction_path"] == "fallback" for r in rows) / n * 100,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="单次调用 vs 两次调用 的准确率与延迟对比")
+    parser.add_argument("--limit", type=int, default=None, help="只评估前 N 条")
+    parser.add_argument("--stub-graph", action="store_true", help="使用内存 SQLite 图后端")
+    parser.add_argument("--output", default="evaluation_single_pass.csv")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.stub_graph:
+        os.environ["KG_BACKEND"] = "sqlite"
+        os.environ["KG_SQLITE_PATH"] = ":memory:"
+
+    import entity_extractor
+    import two_stage
+
+    counter = CallCounter()
+    two_stage.generate_answer = counter.wrap(two_stage.generate_answer)
+    two_stage.generate_structured = counter.wrap(two_stage.generate_structured)
+    entity_extractor._call_llm_for_extraction = counter.wrap(entity_extractor._call_llm_for_extraction)
+
+    cases = load_test_cases()
+    cases = cases[:args.limit] if args.limit else cases
+    results = {}
+    all_rows = []
+    for single_pass in (False, True):
+        rows = run_mode(cases, single_pass, counter, quiet=not args.verbose)
+        results[rows[0]["mode"]] = summarize(rows)
+        all_rows.extend(rows)
+
+    print(f"\n📊 单次调用 vs 两次调用（{len(cases)} 条）:")
+    print(f"   {'指标':24s}{'two_call':>12s}{'single_pass':>14s}")
+    labels = [
+        ("Answer F1 (%)", "answer_f1"),
+        ("LLM Answer F1 (%)", "llm_answer_f1"),
+        ("Hits@1 (%)", "hits_at_1"),
+        ("Triple F1 (%)", "triple_f1"),
+        ("LLM calls / question", "llm_calls"),
+        ("Latency mean (ms)", "latency_mean"),
+        ("Latency p50 (ms)", "latency_p50"),
+        ("Latency p95 (ms)", "latency_p95"),
+        ("Fallback rate (%)", "fallback_rate"),
+    ]
+    for label, key in labels:
+        print(f"   • {label:22s}{results['two_call'][key]:12.2f}{results['single_pass'][key]:14.2f}")
+
+    with open(args.output, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(all_rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(all_rows)
+    print(f"\n✅ 逐条结果已保存至: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,557 @@
+# coding=utf-8
+"""
+图数据后端抽象层 —— 把“实体列表 / 模板查询 / 批量导入”三类操作从 Neo4j 中解耦出来。
+
+- Neo4jBackend：原有的 bolt 连接实现，整个进程共用一个 driver
+- SQLiteBackend：嵌入式实现，节点表 + 边表（带索引），可以直接从 data/*.csv 加载，
+  适合小规模部署和本地测试，不需要启动 Neo4j
+
+通过环境变量 KG_BACKEND=neo4j|sqlite 选择后端，默认 neo4j。
+"""
+import hashlib
+from abc import ABC, abstractmethod
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+# CSV 格式（节点文件、关系类型）与预检只在 csv_preflight 中定义一次
+from csv_preflight import RELATION_LABELS, CsvPreflight
+
+# 图中的三类实体
+ENTITY_LABELS = ("作品", "专辑", "人物")
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+DEFAULT_SQLITE_PATH = os.path.join(DATA_DIR, "kg.sqlite3")
+
+
+def read_csv_graph(data_dir: str = DATA_DIR):
+    """
+    经预检读取 data 目录下的节点/关系 CSV。
+    返回 (nodes, relations)：nodes 为 {标签: [name, ...]}（已规范化、去重），
+    relations 为逐行产出 (head, relation, tail) 的生成器，只包含端点存在且不重复的关系。
+    """
+    preflight = CsvPreflight(data_dir)
+    return preflight.nodes(), preflight.relations()
+
+
+class GraphBackend(ABC):
+    """图数据后端接口"""
+
+    name = "base"
+
+    @abstractmethod
+    def list_entities(self, label: str) -> List[str]:
+        """返回某一类实体（作品/专辑/人物）的全部名称"""
+
+    @abstractmethod
+    def run_template(self, index: int, val: str, after: tuple = (), limit: int = 1) -> Iterator[tuple]:
+        """
+        执行 handler.patterns[index] 对应的模板查询，逐条产出答案的排序键，最后一项为 name：
+        一般模板为 (name,)，按合作次数排名的模板为 (weight, name)。
+        after/limit 用于 keyset 分页：只返回排在 after 之后的前 limit 条。
+        """
+
+    @abstractmethod
+    def derive_collaborations(self, works: Iterable[str] = None) -> int:
+        """
+        根据共同作品推导人物之间的 合作 边（双向），weight 为共同作品数。
+        works 为发生变化的作品名：只重算与这些作品相关的人物；为 None 时全量重算。
+        返回写入的 合作 边数。
+        """
+
+    @abstractmethod
+    def bulk_load(self, nodes: Dict[str, Iterable[str]], relations: Iterable[Tuple[str, str, str]]) -> Dict[str, int]:
+        """批量写入节点和 (head, relation, tail) 关系，返回各类写入数量"""
+
+    @abstractmethod
+    def graph_version(self) -> str:
+        """
+        图数据版本号：每次导入后变化，用于让依赖图数据的缓存（评估输出、查询结果）失效。
+        从未导入过时为 "0"。
+        """
+
+    def close(self):
+        pass
+
+
+# ==============================================================================
+# 合作 边推导：共同参与同一作品（共同演唱、歌手与作词人）的两个人物互为合作者，
+# weight 为共同作品数。边是双向物化的，查询时只需从人物出发走一跳。
+# ==============================================================================
+COLLABORATION_SOURCES = ("歌手", "作词")
+
+NEO4J_CLEAR_ALL_COLLABORATIONS = "MATCH (:人物)-[r:合作]->(:人物) DELETE r"
+
+NEO4J_DERIVE_ALL_COLLABORATIONS = """
+MATCH (w:作品)-[:歌手|作词]->(p:人物)
+WITH w, collect(DISTINCT p) AS people
+UNWIND people AS a
+UNWIND people AS b
+WITH a, b, count(w) AS weight
+WHERE a <> b
+CREATE (a)-[:合作 {weight: weight}]->(b)
+"""
+
+# 受影响的人物：变化作品当前的参与者，加上他们现有的合作者。
+# 后者覆盖从作品中被移除的人物，他们与原合作者之间的旧 合作 边（及 weight）需要删除或重算。
+NEO4J_AFFECTED_PERSONS = """
+MATCH (w:作品)-[:歌手|作词]->(p:人物)
+WHERE w.name IN $works
+OPTIONAL MATCH (p)-[:合作]-(c:人物)
+WITH collect(DISTINCT p.name) + collect(DISTINCT c.name) AS names
+UNWIND names AS name
+RETURN collect(DISTINCT name) AS persons
+"""
+
+NEO4J_CLEAR_COLLABORATIONS = """
+MATCH (a:人物)-[r:合作]-(:人物)
+WHERE a.name IN $persons
+DELETE r
+"""
+
+NEO4J_DERIVE_COLLABORATIONS = """
+MATCH (a:人物)<-[:歌手|作词]-(w:作品)-[:歌手|作词]->(b:人物)
+WHERE a.name IN $persons AND a <> b
+WITH a, b, count(DISTINCT w) AS weight
+MERGE (a)-[r1:合作]->(b) SET r1.weight = weight
+MERGE (b)-[r2:合作]->(a) SET r2.weight = weight
+"""
+
+
+# 图数据版本号：存放在唯一的 :_KGMeta 节点上，导入脚本和 bulk_load 每次导入后递增
+NEO4J_GRAPH_VERSION = "MATCH (m:_KGMeta {key: 'graph'}) RETURN m.version AS version"
+NEO4J_BUMP_GRAPH_VERSION = (
+    "MERGE (m:_KGMeta {key: 'graph'}) "
+    "SET m.version = coalesce(m.version, 0) + 1, m.updated_at = timestamp()"
+)
+
+
+# ==============================================================================
+# 查询模板：下标与 handler.patterns 一一对应，两个后端的模板放在一起维护
+# ==============================================================================
+# Neo4j 后端的 Cypher 模板；结果都按排序键有序（单答案模板也按 name 排序，跨分片归并后结果确定）。
+# 分页模板带 $after / $limit，按合作次数排名的模板另带 $after_weight
+NEO4J_TEMPLATES = [
+    "MATCH (a:作品{name:$val})-[:所属专辑]->(b:专辑) RETURN b.name AS name ORDER BY name LIMIT $limit",
+    "MATCH (a:作品{name:$val})-[:作词]->(b:人物) RETURN b.name AS name ORDER BY name LIMIT $limit",
+    "MATCH (a:作品{name:$val})-[:歌手]->(b:人物) RETURN b.name AS name ORDER BY name LIMIT $limit",
+    "MATCH (a:专辑{name:$val})<-[:所属专辑]-(b:作品) WHERE b.name > $after RETURN b.name AS name ORDER BY name LIMIT $limit",
+    "MATCH (a:人物{name:$val})<-[:歌手]-(b:作品) WHERE b.name > $after RETURN b.name AS name ORDER BY name LIMIT $limit",
+    "MATCH (a:人物{name:$val})<-[:作词]-(b:作品) WHERE b.name > $after RETURN b.name AS name ORDER BY name LIMIT $limit",
+    "MATCH (a:人物{name:$val})-[r:合作]->(b:人物) WHERE $after_weight IS NULL OR r.weight < $after_weight OR (r.weight = $after_weight AND b.name > $after) RETURN r.weight AS weight, b.name AS name ORDER BY weight DESC, name LIMIT $limit",
+    "MATCH (a:作品{name:$val})-[:歌手]->(b:人物) RETURN b.name AS name ORDER BY name LIMIT $limit", # Mapped to (.+)是谁唱的
+    "MATCH (a:作品{name:$val})-[:所属专辑]->(b:专辑) RETURN b.name AS name ORDER BY name LIMIT $limit", # Mapped to (.+)是哪个专辑的
+    "MATCH (a:作品{name:$val})-[:歌手]->(b:人物) RETURN b.name AS name ORDER BY name LIMIT $limit", # Mapped to 谁唱的(.+)
+    "MATCH (a:作品{name:$val})-[:作词]->(b:人物) RETURN b.name AS name ORDER BY name LIMIT $limit", # Mapped to 谁作词的(.+)
+]
+
+# SQLite 后端的同一组模板：(起点标签, 关系, 方向, 终点标签, 排序)
+# 方向 out 表示 (val)-[rel]->(answer)，in 表示 (val)<-[rel]-(answer)
+# 排序 name 按名称升序；weight 按边权重降序、名称升序
+SQLITE_TEMPLATES = [
+    ("作品", "所属专辑", "out", "专辑", "name"),
+    ("作品", "作词", "out", "人物", "name"),
+    ("作品", "歌手", "out", "人物", "name"),
+    ("专辑", "所属专辑", "in", "作品", "name"),
+    ("人物", "歌手", "in", "作品", "name"),
+    ("人物", "作词", "in", "作品", "name"),
+    ("人物", "合作", "out", "人物", "weight"),
+    ("作品", "歌手", "out", "人物", "name"),
+    ("作品", "所属专辑", "out", "专辑", "name"),
+    ("作品", "歌手", "out", "人物", "name"),
+    ("作品", "作词", "out", "人物", "name"),
+]
+
+
+# ==============================================================================
+# Neo4j 实现
+# ==============================================================================
+class Neo4jBackend(GraphBackend):
+    name = "neo4j"
+
+    def __init__(self, batch_size: int = 500, database: str = None, driver=None):
+        self.batch_size = batch_size
+        self.database = database  # 为 None 时使用服务器默认数据库；分片部署时每个分片一个数据库
+        self._driver = driver  # 为 None 时首次使用时按 db.py 的配置连接（导入脚本传入自己的 driver）
+        self._lock = threading.Lock()
+
+    @property
+    def driver(self):
+        if self._driver is None:
+            with self._lock:
+                if self._driver is None:
+                    from db import get_db
+                    self._driver = get_db()
+        return self._driver
+
+    def _session(self):
+        return self.driver.session(database=self.database)
+
+    def list_entities(self, label: str) -> List[str]:
+        if label not in ENTITY_LABELS:
+            raise ValueError(f"未知实体类型: {label}")
+        with self._session() as session:
+            result = session.run(f"MATCH (n:{label}) RETURN n.name AS name")
+            return [record["name"] for record in result]
+
+    def run_template(self, index: int, val: str, after: tuple = (), limit: int = 1) -> Iterator[tuple]:
+        after_weight = after[0] if len(after) == 2 else None
+        with self._session() as session:
+            result = session.run(NEO4J_TEMPLATES[index], val=val, after=after[-1] if after else "",
+                                 after_weight=after_weight, limit=limit)
+            for record in result:
+                if "weight" in record.keys():
+                    yield record["weight"], record["name"]
+                else:
+                    yield (record["name"],)
+
+    def bulk_load(self, nodes, relations):
+        counts = {}
+        with self._session() as session:
+            for label, names in nodes.items():
+                if label not in ENTITY_LABELS:
+                    raise ValueError(f"未知实体类型: {label}")
+                query = f"UNWIND $names AS name MERGE (:{label} {{name: name}})"
+                counts[label] = 0
+                for batch in _batched(names, self.batch_size):
+                    session.run(query, names=batch).consume()
+                    counts[label] += len(batch)
+
+            by_rel = {}
+            for head, rel, tail in relations:
+                if rel in RELATION_LABELS:
+                    by_rel.setdefault(rel, []).append({"head": head, "tail": tail})
+            for rel, rows in by_rel.items():
+                head_label, tail_label = RELATION_LABELS[rel]
+                query = (
+                    f"UNWIND $rows AS row "
+                    f"MATCH (h:{head_label} {{name: row.head}}) "
+                    f"MATCH (t:{tail_label} {{name: row.tail}}) "
+                    f"MERGE (h)-[:{rel}]->(t)"
+                )
+                counts[rel] = 0
+                for batch in _batched(rows, self.batch_size):
+                    session.run(query, rows=batch).consume()
+                    counts[rel] += len(batch)
+        works = {row["head"] for rows in by_rel.values() for row in rows}
+        counts["合作"] = self.derive_collaborations(works)
+        self.bump_graph_version()
+        return counts
+
+    def bump_graph_version(self):
+        """递增 :_KGMeta 上的图数据版本号（每次导入后调用）"""
+        with self._session() as session:
+            session.run(NEO4J_BUMP_GRAPH_VERSION).consume()
+
+    def graph_version(self) -> str:
+        with self._session() as session:
+            record = session.run(NEO4J_GRAPH_VERSION).single()
+        return str(record["version"]) if record and record["version"] is not None else "0"
+
+    def derive_collaborations(self, works=None):
+        with self._session() as session:
+            if works is None:
+                session.run(NEO4J_CLEAR_ALL_COLLABORATIONS).consume()
+                summary = session.run(NEO4J_DERIVE_ALL_COLLABORATIONS).consume()
+                return summary.counters.relationships_created
+            works = list(works)
+            if not works:
+                return 0
+            persons = session.run(NEO4J_AFFECTED_PERSONS, works=works).single()["persons"]
+            session.run(NEO4J_CLEAR_COLLABORATIONS, persons=persons).consume()
+            summary = session.run(NEO4J_DERIVE_COLLABORATIONS, persons=persons).consume()
+            return summary.counters.relationships_created
+
+    def close(self):
+        if self._driver is not None:
+            self._driver.close()
+            self._driver = None
+
+
+# ==============================================================================
+# SQLite 实现
+# ==============================================================================
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    id    INTEGER PRIMARY KEY,
+    label TEXT NOT NULL,
+    name  TEXT NOT NULL,
+    UNIQUE (label, name)
+);
+CREATE TABLE IF NOT EXISTS edges (
+    src    INTEGER NOT NULL REFERENCES nodes(id),
+    rel    TEXT NOT NULL,
+    dst    INTEGER NOT NULL REFERENCES nodes(id),
+    weight INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (src, rel, dst)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS edges_dst ON edges (dst, rel, src);
+CREATE INDEX IF NOT EXISTS edges_rank ON edges (src, rel, weight DESC, dst);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+
+def _template_sql(direction: str, order: str) -> str:
+    near, far = ("src", "dst") if direction == "out" else ("dst", "src")
+    if order == "weight":
+        select, keyset, order_by = (
+            "e.weight, b.name",
+            "(? IS NULL OR e.weight < ? OR (e.weight = ? AND b.name > ?))",
+            "e.weight DESC, b.name",
+        )
+    else:
+        select, keyset, order_by = "b.name", "b.name > ?", "b.name"
+    return (
+        f"SELECT {select} FROM nodes a "
+        f"JOIN edges e ON e.{near} = a.id AND e.rel = ? "
+        f"JOIN nodes b ON b.id = e.{far} "
+        f"WHERE a.label = ? AND a.name = ? AND b.label = ? AND {keyset} "
+        f"ORDER BY {order_by} LIMIT ?"
+    )
+
+
+_COLLAB_SOURCES_SQL = ", ".join(f"'{rel}'" for rel in COLLABORATION_SOURCES)
+
+SQLITE_AFFECTED_PERSONS = f"""
+SELECT DISTINCT e.dst FROM edges e JOIN nodes w ON w.id = e.src
+WHERE e.rel IN ({_COLLAB_SOURCES_SQL}) AND w.label = '作品' AND w.name = ?
+"""
+
+SQLITE_COLLABORATORS = "SELECT dst FROM edges WHERE rel = '合作' AND src = ?"
+
+# a, b 为参与同一作品的两个人物；:persons 限定时只推导以这些人物为一端的边
+SQLITE_COLLABORATION_PAIRS = f"""
+SELECT e1.dst AS a, e2.dst AS b, COUNT(DISTINCT e1.src) AS weight
+FROM edges e1
+JOIN edges e2 ON e2.src = e1.src AND e2.rel IN ({_COLLAB_SOURCES_SQL}) AND e2.dst <> e1.dst
+WHERE e1.rel IN ({_COLLAB_SOURCES_SQL}) {{where}}
+GROUP BY e1.dst, e2.dst
+"""
+
+
+class SQLiteBackend(GraphBackend):
+    name = "sqlite"
+
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH):
+        # :memory: 改用共享缓存的内存库，使各线程连接看到同一份数据
+        if path == ":memory:":
+            self._uri = f"file:kg_{id(self)}?mode=memory&cache=shared"
+        else:
+            self._uri = "file:" + os.path.abspath(path)
+        self._local = threading.local()
+        self._anchor = self._connect()  # 内存库需要至少一个连接保持打开
+        self._anchor.executescript(SQLITE_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self._uri, uri=True, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def is_empty(self) -> bool:
+        return self.conn.execute("SELECT 1 FROM nodes LIMIT 1").fetchone() is None
+
+    def list_entities(self, label: str) -> List[str]:
+        if label not in ENTITY_LABELS:
+            raise ValueError(f"未知实体类型: {label}")
+        rows = self.conn.execute("SELECT name FROM nodes WHERE label = ?", (label,))
+        return [row[0] for row in rows]
+
+    def run_template(self, index: int, val: str, after: tuple = (), limit: int = 1) -> Iterator[tuple]:
+        from_label, rel, direction, to_label, order = SQLITE_TEMPLATES[index]
+        if order == "weight":
+            weight, name = after if after else (None, "")
+            keyset = (weight, weight, weight, name)
+        else:
+            keyset = (after[-1] if after else "",)
+        params = (rel, from_label, val, to_label) + keyset + (limit,)
+        cursor = self.conn.execute(_template_sql(direction, order), params)
+        try:
+            for row in cursor:
+                yield tuple(row)
+        finally:
+            cursor.close()
+
+    def bulk_load(self, nodes, relations):
+        counts = {}
+        conn = self.conn
+        digest = hashlib.sha1()
+        with conn:
+            for label, names in nodes.items():
+                if label not in ENTITY_LABELS:
+                    raise ValueError(f"未知实体类型: {label}")
+
+                def node_rows(label=label, names=names):
+                    for name in names:
+                        digest.update(f"{label}\t{name}\n".encode("utf-8"))
+                        yield label, name
+
+                before = conn.total_changes
+                conn.executemany("INSERT OR IGNORE INTO nodes (label, name) VALUES (?, ?)", node_rows())
+                counts[label] = conn.total_changes - before
+
+            works = set()
+
+            def edge_rows():
+                for head, rel, tail in relations:
+                    if rel in RELATION_LABELS:
+                        head_label, tail_label = RELATION_LABELS[rel]
+                        works.add(head)
+                        digest.update(f"{head}\t{rel}\t{tail}\n".encode("utf-8"))
+                        yield rel, head_label, head, tail_label, tail
+
+            before = conn.total_changes
+            # 端点不存在时子查询为 NULL，被 NOT NULL 约束拒绝后由 OR IGNORE 丢弃
+            conn.executemany(
+                "INSERT OR IGNORE INTO edges (src, rel, dst) VALUES ("
+                "(SELECT id FROM nodes WHERE label = ?2 AND name = ?3), ?1, "
+                "(SELECT id FROM nodes WHERE label = ?4 AND name = ?5))",
+                edge_rows()
+            )
+            counts["relations"] = conn.total_changes - before
+        counts["合作"] = self.derive_collaborations(works)
+        if any(count for key, count in counts.items() if key != "合作"):
+            # 版本号由上一个版本和本次导入内容推导：同样的数据重新加载得到同样的版本，重复导入不改变版本
+            # （合作 边由基础关系推导，重算不算数据变化）
+            self._set_graph_version(hashlib.sha1(
+                (self.graph_version() + digest.hexdigest()).encode("ascii")
+            ).hexdigest()[:16])
+        conn.execute("ANALYZE")
+        return counts
+
+    def graph_version(self) -> str:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'graph_version'").fetchone()
+        return row[0] if row else "0"
+
+    def _set_graph_version(self, version: str):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('graph_version', ?)", (version,)
+            )
+
+    def derive_collaborations(self, works=None):
+        conn = self.conn
+        with conn:
+            if works is None:
+                conn.execute("DELETE FROM edges WHERE rel = '合作'")
+                where, params = "", ()
+            else:
+                persons = set()
+                for work in works:
+                    persons.update(row[0] for row in conn.execute(SQLITE_AFFECTED_PERSONS, (work,)))
+                # 连同现有合作者一起重算（见 NEO4J_AFFECTED_PERSONS）
+                for person in list(persons):
+                    persons.update(row[0] for row in conn.execute(SQLITE_COLLABORATORS, (person,)))
+                if not persons:
+                    return 0
+                conn.execute("CREATE TEMP TABLE IF NOT EXISTS affected (id INTEGER PRIMARY KEY)")
+                conn.execute("DELETE FROM affected")
+                conn.executemany("INSERT INTO affected (id) VALUES (?)", ((p,) for p in persons))
+                conn.execute(
+                    "DELETE FROM edges WHERE rel = '合作' AND "
+                    "(src IN (SELECT id FROM affected) OR dst IN (SELECT id FROM affected))"
+                )
+                where, params = "AND e1.dst IN (SELECT id FROM affected)", ()
+            before = conn.total_changes
+            pairs = SQLITE_COLLABORATION_PAIRS.format(where=where)
+            # 两个方向都写入；第二条补齐受影响人物与未受影响人物之间的反向边
+            conn.execute(
+                f"INSERT OR REPLACE INTO edges (src, rel, dst, weight) SELECT a, '合作', b, weight FROM ({pairs})",
+                params
+            )
+            conn.execute(
+                f"INSERT OR IGNORE INTO edges (src, rel, dst, weight) SELECT b, '合作', a, weight FROM ({pairs})",
+                params
+            )
+            return conn.total_changes - before
+
+    def load_csv(self, data_dir: str = DATA_DIR) -> Dict[str, int]:
+        """直接从 data/*.csv 加载整个图"""
+        nodes, relations = read_csv_graph(data_dir)
+        return self.bulk_load(nodes, relations)
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+        if self._anchor is not None:
+            self._anchor.close()
+            self._anchor = None
+
+
+def _batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# ==============================================================================
+# 单例：按 KG_BACKEND 环境变量创建后端
+# ==============================================================================
+_backend_instance = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(kind: str = None, sqlite_path: str = None, data_dir: str = DATA_DIR,
+                   database: str = None) -> GraphBackend:
+    """
+    创建后端。sqlite_path / data_dir / database 供分片使用（见 shards.py），
+    默认分别取 KG_SQLITE_PATH、data 目录和 Neo4j 默认数据库。
+    """
+    kind = (kind or os.getenv("KG_BACKEND", "neo4j")).lower()
+    if kind == "neo4j":
+        return Neo4jBackend(database=database)
+    if kind == "sqlite":
+        backend = SQLiteBackend(sqlite_path or os.getenv("KG_SQLITE_PATH", DEFAULT_SQLITE_PATH))
+        if backend.is_empty():
+            print(f"SQLite 图为空，从 CSV 加载: {backend.load_csv(data_dir)}")
+        return backend
+    raise ValueError(f"未知图后端: {kind}")
+
+
+def graph_version() -> str:
+    """当前部署的图数据版本：分片部署时为全部分片版本的摘要，否则为后端单例的版本"""
+    from shards import get_shard_manager
+    manager = get_shard_manager()
+    if manager is not None:
+        return manager.graph_version()
+    backend = get_backend()
+    return f"{backend.name}:{backend.graph_version()}"
+
+
+def get_backend() -> GraphBackend:
+    """获取图后端单例"""
+    global _backend_instance
+    if _backend_instance is None:
+        with _backend_lock:
+            if _backend_instance is None:
+                _backend_instance = create_backend()
+    return _backend_instance
+
+
+def reset_backend():
+    """关闭并丢弃当前后端单例，下次 get_backend() 时重新创建"""
+    global _backend_instance
+    with _backend_lock:
+        if _backend_instance is not None:
+            _backend_instance.close()
+            _backend_instance = None
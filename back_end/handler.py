@@ -1,7 +1,24 @@
 # coding=utf-8
-from db import get_db, close_db
+from contextlib import ExitStack, closing
+from functools import partial
+from graph_backend import NEO4J_TEMPLATES, SQLITE_TEMPLATES, get_backend
+from itertools import islice
+from profiling import stage
+from query_cache import query_cache
+from shards import get_shard_manager
+import base64
+import heapq
+import json
+import os
 import re
 
+# 反向查询（一对多）的分页参数：按排序键 keyset 分页（name，或合作次数 weight + name）
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+
+# 没有命中正则时是否启用检索式路由兜底（见 retrieval_router.py）
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "1") == "1"
+
 patterns = [
     '歌曲(.+)所属的音乐专辑是',
     '歌曲(.+)的作词人是',
@@ -16,44 +33,83 @@ patterns = [
     '谁作词的(.+)', # New
 ]
 
-queries = [
-    "MATCH (a:作品{name:$val})-[:所属专辑]->(b:专辑) RETURN b.name AS name LIMIT 1",
-    "MATCH (a:作品{name:$val})-[:作词]->(b:人物) RETURN b.name AS name LIMIT 1",
-    "MATCH (a:作品{name:$val})-[:歌手]->(b:人物) RETURN b.name AS name LIMIT 1",
-    "MATCH (a:专辑{name:$val})<-[:所属专辑]-(b:作品) RETURN b.name AS name",
-    "MATCH (a:人物{name:$val})<-[:歌手]-(b:作品) RETURN b.name AS name LIMIT 10",
-    "MATCH (a:人物{name:$val})<-[:作词]-(b:作品) RETURN b.name AS name LIMIT 10",
-    "MATCH (a:人物{name:$val})-[:合作]->(b:人物) RETURN b.name AS name LIMIT 10",
-    "MATCH (a:作品{name:$val})-[:歌手]->(b:人物) RETURN b.name AS name LIMIT 1", # Mapped to (.+)是谁唱的
-    "MATCH (a:作品{name:$val})-[:所属专辑]->(b:专辑) RETURN b.name AS name LIMIT 1", # Mapped to (.+)是哪个专辑的
-    "MATCH (a:作品{name:$val})-[:歌手]->(b:人物) RETURN b.name AS name LIMIT 1", # Mapped to 谁唱的(.+)
-    "MATCH (a:作品{name:$val})-[:作词]->(b:人物) RETURN b.name AS name LIMIT 1", # Mapped to 谁作词的(.+)
-]
+# 预编译模板正则（prefork 模式下在父进程编译一次，worker 共享）
+compiled_patterns = [re.compile(p) for p in patterns]
+
+# 与 patterns 一一对应的 Cypher 模板，和 SQLite 模板一起定义在 graph_backend 中
+queries = NEO4J_TEMPLATES
+
+
+# 需要分页的模板下标（其余模板 LIMIT 1，只有单个答案）
+PAGINATED_QUERIES = {3, 4, 5, 6}
+# 按合作次数 weight 降序排名的模板，排序键为 (weight, name)；其余分页模板排序键为 (name,)
+RANKED_QUERIES = {6}
+# 跨分片合并排名模板时每个分片取回全部结果（两个后端的 LIMIT 都接受的 64 位整数）
+UNBOUNDED_LIMIT = 2 ** 62
+
+
+def encode_cursor(sort_key) -> str:
+    """把上一页最后一条的排序键编码成不透明游标"""
+    raw = json.dumps(list(sort_key), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """解析游标，返回上一页最后一条的排序键；格式不对时抛 ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+    except Exception as e:
+        raise ValueError(f"cursor无效: {cursor}") from e
+    if not isinstance(values, list) or len(values) not in (1, 2) or not isinstance(values[-1], str):
+        raise ValueError(f"cursor无效: {cursor}")
+    if len(values) == 2 and (not isinstance(values[0], int) or isinstance(values[0], bool)):
+        raise ValueError(f"cursor无效: {cursor}")
+    return tuple(values)
 
 
-def query_handler(question):
-    """原有 KG 查询逻辑，完全保留"""
+def _normalize_page_size(page_size):
+    if page_size is None:
+        return DEFAULT_PAGE_SIZE
+    if isinstance(page_size, bool):
+        raise ValueError("page_size必须是整数")
+    try:
+        page_size = int(page_size)
+    except (TypeError, ValueError):
+        raise ValueError("page_size必须是整数")
+    if page_size < 1 or page_size > MAX_PAGE_SIZE:
+        raise ValueError(f"page_size必须在1到{MAX_PAGE_SIZE}之间")
+    return page_size
+
+
+def query_handler(question, page_size=None, cursor=None):
+    """
+    原有 KG 查询逻辑；反向查询按 name 排序并支持 keyset 分页。
+    page_size: 每页条数（默认 DEFAULT_PAGE_SIZE）
+    cursor: 上一页返回的 next_cursor，为空表示第一页
+    """
     print("问题：", question)
-    for index, pattern in enumerate(patterns):
-        matchObj = re.match(pattern, question)
+    try:
+        limit = _normalize_page_size(page_size)
+        after = decode_cursor(cursor) if cursor else ()
+    except ValueError as e:
+        return {
+            "state": 1,
+            "msg": str(e)
+        }
+    for index, pattern in enumerate(compiled_patterns):
+        matchObj = pattern.match(question)
         if matchObj:
-            print("匹配成功 pattern is: ", pattern)
-            val = matchObj.group(1)
-            query = queries[index]
-            db = get_db()
-            try:
-                with db.session() as session:
-                    result = session.run(query, val=val)
-                    rows = result.values('name')
-                    rows = [row[0] for row in rows]
-                    print("查询结果：", rows)
-                return {
-                    "state": 0,
-                    "data": rows,
-                    "msg": "查询成功"
-                }
-            finally:
-                close_db(db)
+            print("匹配成功 pattern is: ", pattern.pattern)
+            return _run_template(index, matchObj.group(1), after, limit, cursor)
+    # 没有命中任何正则：用检索式路由找最近的模板 + 实体
+    route = route_by_retrieval(question)
+    if route is not None:
+        print("检索路由成功：", route)
+        response = _run_template(route["template"], route["entity"], after, limit, cursor)
+        response["matched_by"] = "retrieval"
+        response["route"] = route
+        return response
     print("匹配失败")
     return {
         "state": 1,
@@ -61,6 +117,134 @@ def query_handler(question):
     }
 
 
+def query_all(question):
+    """
+    内部调用（两阶段问答的 KG 核验、评估）：按 MAX_PAGE_SIZE 翻页直到 next_cursor 为空，
+    取回全部答案，与引入分页前的无界查询结果一致；默认的小页只用于对外的 /query
+    """
+    res = query_handler(question, page_size=MAX_PAGE_SIZE)
+    while res["state"] == 0 and res.get("next_cursor"):
+        page = query_handler(question, page_size=MAX_PAGE_SIZE, cursor=res["next_cursor"])
+        if page["state"] != 0:
+            return page
+        res["data"] = res["data"] + page["data"]
+        res["next_cursor"] = page["next_cursor"]
+    return res
+
+
+def route_by_retrieval(question: str):
+    """检索式路由兜底（ROUTER_ENABLED=0 或缺少 numpy/scipy 时返回 None）"""
+    if not ROUTER_ENABLED:
+        return None
+    from retrieval_router import route_question
+    question = question.strip()
+    manager = get_shard_manager()
+    with stage("retrieval_route"):
+        if manager is None:
+            return route_question(question)
+        # 分片部署：用问句提到的实体找到分片，再用该分片词典上的路由器
+        _, names = manager.shards_for_question(question)
+        for name in names:
+            with manager.use([name]) as (shard,):
+                router = shard.router
+            route = router.route(question) if router is not None else None
+            if route is not None:
+                route["shard"] = name
+                return route
+        return None
+
+
+def _run_template(index, val, after, limit, cursor):
+    paginated = index in PAGINATED_QUERIES
+    if after and len(after) != (2 if index in RANKED_QUERIES else 1):
+        return {
+            "state": 1,
+            "msg": f"cursor无效: {cursor}"
+        }
+    # 多取一条用来判断是否还有下一页
+    fetch = limit + 1 if paginated else 1
+    manager = get_shard_manager()
+    shard_names = None
+    with stage("graph_query"):
+        if manager is None:
+            backend = get_backend()
+            scopes = [(backend.name, backend.graph_version)]
+        else:
+            # 分片部署：只查询含有该实体（且类型与模板槽位一致）的分片，按排序键归并
+            shard_names = manager.shards_for_entity(val, label=SQLITE_TEMPLATES[index][0])
+            scopes = [(f"shard:{name}", partial(manager.shard_version, name)) for name in shard_names]
+        # 读穿缓存：相同模板 + 实体 + 分页位置在图数据版本不变时不再访问数据库
+        keys = query_cache.get_or_run(
+            scopes, (index, val, after, fetch),
+            partial(_fetch_sort_keys, index, val, after, fetch, manager, shard_names)
+        )
+    has_more = paginated and len(keys) > limit
+    if has_more:
+        keys = keys[:limit]
+    rows = [key[-1] for key in keys]
+    print("查询结果：", rows)
+    response = {
+        "state": 0,
+        "data": rows,
+        "next_cursor": encode_cursor(keys[-1]) if has_more else None,
+        "msg": "查询成功"
+    }
+    if shard_names is not None:
+        response["shards"] = shard_names
+    return response
+
+
+def _fetch_sort_keys(index, val, after, fetch, manager=None, shard_names=None):
+    """实际执行模板查询，逐条读取至多 fetch 个排序键，不整体物化结果集"""
+    with ExitStack() as stack:
+        if manager is None:
+            result = stack.enter_context(closing(get_backend().run_template(index, val, after=after, limit=fetch)))
+        else:
+            shards = stack.enter_context(manager.use(shard_names))
+            if index in RANKED_QUERIES and len(shards) > 1:
+                return _merge_ranked_shards(index, val, after, fetch, shards)
+            result = _merge_shard_results(index, [
+                stack.enter_context(closing(shard.backend.run_template(index, val, after=after, limit=fetch)))
+                for shard in shards
+            ])
+        return list(islice(result, fetch))
+
+
+def _merge_shard_results(index, results):
+    """
+    多个分片各自按 name 有序的结果归并，同一答案只保留一次；keyset 游标对归并结果同样有效。
+    单答案模板各分片也按 name 排序取前 limit 条，条数限制由调用方在归并之后施加
+    """
+    if len(results) == 1:
+        return results[0]
+    merged = heapq.merge(*results, key=lambda key: key[-1])
+
+    def dedupe():
+        last = None
+        for key in merged:
+            if key != last:
+                yield key
+            last = key
+
+    return dedupe()
+
+
+def _merge_ranked_shards(index, val, after, fetch, shards):
+    """
+    按合作次数排名的模板跨分片合并：同一人物可能出现在多个分片且 weight 不同，
+    因此取回各分片的全部结果按名字合并（weight 取最大值），排序后再应用 keyset 游标和条数限制
+    """
+    weights = {}
+    for shard in shards:
+        with closing(shard.backend.run_template(index, val, limit=UNBOUNDED_LIMIT)) as result:
+            for weight, name in result:
+                weights[name] = max(weight, weights.get(name, weight))
+    ranked = sorted(((weight, name) for name, weight in weights.items()), key=lambda key: (-key[0], key[1]))
+    if after:
+        ranked = [key for key in ranked if (-key[0], key[1]) > (-after[0], after[1])]
+    return ranked[:fetch]
+
+
 # ========== 新增：仅用于推断关系类型（不改变原有查询逻辑）==========
 def get_relation_type_from_question(question: str) -> str:
     """
@@ -89,8 +273,8 @@ def get_relation_type_from_question(question: str) -> str:
 
 def extract_entity_for_kg_query(question: str):
     """仅用于从问题中提取 KG 查询所需的实体值（即 patterns 中的 (.+) 部分）"""
-    for pattern in patterns:
-        match = re.match(pattern, question)
+    for pattern in compiled_patterns:
+        match = pattern.match(question)
         if match:
             return match.group(1).strip()
     return None
@@ -99,8 +283,8 @@ def extract_entity_for_kg_query(question: str):
 # handler.py 末尾添加
 def extract_head_entity(question: str) -> str:
     """从问题中提取 pattern 中的 (.+) 部分，用于构造三元组 head"""
-    for pattern in patterns:
-        match = re.match(pattern, question.strip())
+    for pattern in compiled_patterns:
+        match = pattern.match(question.strip())
         if match:
             return match.group(1).strip()
     return ""
\ No newline at end of file
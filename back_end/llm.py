@@ -1,35 +1,396 @@
 # back_end/llm.py
 import requests
+import hashlib
 import json
+import os
 import re
 import subprocess
 import sys
+import threading
+import time
+
+LLM_MODEL = os.getenv("LLM_MODEL", "qwen2.5:1.5b")
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+
+# cli：通过 `ollama run` 子进程生成完整回答（原有方式）
+# stream：通过 Ollama HTTP 接口流式读取，带 token 上限、停止序列和实体提前停止
+LLM_MODE = os.getenv("LLM_MODE", "cli")
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "64"))
+LLM_STOP = [s for s in os.getenv("LLM_STOP", "\n\n").split("|") if s]
+LLM_TIMEOUT = 90
 
 
 def call_llm(question: str) -> str:
+    return generate_answer(question)[0]
+
+
+def generate_answer(question: str, mode: str = None, max_tokens: int = None, stop=None, extractor=None):
+    """
+    生成问题的回答，返回 (answer, metrics)。
+    metrics 包含 mode、total_ms；stream 模式下还有 tokens、ttft_ms、stop_reason。
+    extractor: 流式提前停止时用来识别实体的词典（分片部署时传入问题所属分片的），默认为全局词典。
+    """
     q = question.strip()
     if not q.endswith(('?', '？', '.', '。', '!', '！')):
         q += '？'
 
     full_prompt = f"问题：{q}\n回答："
 
+    if (mode or LLM_MODE) == "stream":
+        return _generate_streaming(question, full_prompt, max_tokens or LLM_MAX_TOKENS,
+                                   LLM_STOP if stop is None else stop, extractor)
+
+    start = time.perf_counter()
     try:
         result = subprocess.run(
-            ["ollama", "run", "qwen2.5:1.5b", full_prompt],
+            ["ollama", "run", LLM_MODEL, full_prompt],
             capture_output=True,
             text=True,
-            timeout=90,
+            timeout=LLM_TIMEOUT,
             encoding='utf-8',
             creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
         )
         output = result.stdout.strip()
 
         # === 关键修复：使用更健壮的解析逻辑 ===
-        return parse_llm_answer(output)
+        answer = parse_llm_answer(output)
 
     except Exception as e:
         print(f"【LLM ERROR】{e}")
-        return "未知"
+        answer = "未知"
+    return answer, {"mode": "cli", "total_ms": (time.perf_counter() - start) * 1000}
+
+
+# ==============================================================================
+# 单次调用模式：一个结构化 Prompt 同时返回回答和三元组（见 entity_extractor.parse_answer_and_triples）
+# ==============================================================================
+ANSWER_WITH_TRIPLES_PROMPT = """你是一个音乐知识问答系统。请回答问题，并给出回答中包含的事实三元组：
+1. answer 为简短回答；
+2. triples 中关系类型只能是：歌手、作词、作曲；
+3. 输出严格为一个 JSON 对象，格式：{{"answer":"回答","triples":[{{"head":"歌曲","relation":"关系","tail":"人物"}}]}}
+
+示例：
+问题：青花瓷的作词人是谁？
+输出：
+{{"answer": "方文山", "triples": [{{"head": "青花瓷", "relation": "作词", "tail": "方文山"}}]}}
+
+问题：{question}
+输出：
+"""
+LLM_STRUCTURED_MAX_TOKENS = int(os.getenv("LLM_STRUCTURED_MAX_TOKENS", "256"))
+
+
+def generate_structured(question: str, mode: str = None):
+    """
+    单次调用生成 JSON 格式的“回答 + 三元组”，返回 (原始输出, metrics)。
+    stream 模式下走 Ollama HTTP 接口并要求 format=json；cli 模式返回去掉思考日志的全部输出。
+    """
+    q = question.strip()
+    if not q.endswith(('?', '？', '.', '。', '!', '！')):
+        q += '？'
+    prompt = ANSWER_WITH_TRIPLES_PROMPT.format(question=q)
+
+    start = time.perf_counter()
+    if (mode or LLM_MODE) == "stream":
+        payload = {
+            "model": LLM_MODEL,
+            "prompt": prompt,
+            "stream": False,
+            "format": "json",
+            "options": {"num_predict": LLM_STRUCTURED_MAX_TOKENS},
+        }
+        try:
+            resp = get_session().post(f"{OLLAMA_HOST}/api/generate", json=payload, timeout=LLM_TIMEOUT)
+            resp.raise_for_status()
+            body = resp.json()
+            output = body.get("response", "")
+            metrics = {"mode": "stream", "tokens": body.get("eval_count")}
+        except Exception as e:
+            print(f"【LLM ERROR】{e}")
+            output, metrics = "", {"mode": "stream", "stop_reason": "error"}
+    else:
+        try:
+            result = subprocess.run(
+                ["ollama", "run", LLM_MODEL, prompt],
+                capture_output=True,
+                text=True,
+                timeout=LLM_TIMEOUT,
+                encoding='utf-8',
+                creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+            )
+            output = result.stdout.strip()
+            output = re.sub(r'^Thinking\.\.\.\s*', '', output, flags=re.MULTILINE)
+            output = re.sub(r'\.{3}done thinking.*$', '', output, flags=re.MULTILINE)
+        except Exception as e:
+            print(f"【LLM ERROR】{e}")
+            output = ""
+        metrics = {"mode": "cli"}
+    metrics["total_ms"] = (time.perf_counter() - start) * 1000
+    return output, metrics
+
+
+# ==============================================================================
+# Prompt 前缀复用：固定的指令 + 示例前缀只求值一次
+# 首次调用用前缀单独“预热”，拿到 Ollama 返回的 context（前缀 token 序列），
+# 之后每次只发送变化的后缀并带上该 context，配合 keep_alive 让服务端复用前缀的 KV 状态。
+# LLM_PREFIX_REUSE=context（默认）| off（每次发送完整 Prompt，用于对比）
+# ==============================================================================
+LLM_PREFIX_REUSE = os.getenv("LLM_PREFIX_REUSE", "context")
+LLM_KEEP_ALIVE = os.getenv("LLM_KEEP_ALIVE", "30m")
+# 前缀复用要求以 raw=True 调用 Ollama（context 才能只接上后缀），此时模型自带的对话模板不会生效，
+# 必须用 LLM_PROMPT_TEMPLATE 显式给出：{prompt} 之前的部分并入缓存的前缀、之后的部分接在后缀末尾，如 qwen2.5：
+#   <|im_start|>user\n{prompt}<|im_end|>\n<|im_start|>assistant\n
+# 未设置 LLM_PROMPT_TEMPLATE 时不复用前缀，完整 Prompt 按非 raw 方式发送，由 Ollama 套用模型自带的模板
+LLM_PROMPT_TEMPLATE = os.getenv("LLM_PROMPT_TEMPLATE", "").replace("\\n", "\n")
+
+
+class PromptPrefixCache:
+    """(模型, 前缀版本, 前缀哈希) → 前缀的 context，以及前缀复用的统计"""
+
+    def __init__(self):
+        self._contexts = {}
+        self._prime_locks = {}
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "primes": 0, "reused": 0,
+                      "prompt_eval_ms": 0.0, "prompt_eval_tokens": 0, "prefix_eval_ms": 0.0}
+
+    @staticmethod
+    def key(prefix: str, version: str):
+        return LLM_MODEL, version, hashlib.sha1(prefix.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        return self._contexts.get(key)
+
+    def put(self, key, context):
+        with self._lock:
+            self._contexts[key] = context
+
+    def prime_lock(self, key) -> threading.Lock:
+        """每个前缀一把锁：并发的首次请求只有一个去预热，其余等待后复用"""
+        with self._lock:
+            return self._prime_locks.setdefault(key, threading.Lock())
+
+    def record(self, metrics: dict):
+        with self._lock:
+            self.stats["calls"] += 1
+            self.stats["reused"] += int(bool(metrics.get("reused_prefix")))
+            self.stats["prompt_eval_ms"] += metrics.get("prompt_eval_ms") or 0.0
+            self.stats["prompt_eval_tokens"] += metrics.get("prompt_eval_tokens") or 0
+
+    def clear(self):
+        with self._lock:
+            self._contexts.clear()
+            self._prime_locks.clear()
+            for k in self.stats:
+                self.stats[k] = 0
+
+    def summary(self) -> dict:
+        s = dict(self.stats)
+        calls = s["calls"] or 1
+        s["avg_prompt_eval_ms"] = s["prompt_eval_ms"] / calls
+        s["avg_prompt_eval_tokens"] = s["prompt_eval_tokens"] / calls
+        return s
+
+
+prefix_cache = PromptPrefixCache()
+
+
+def _ollama_generate(payload: dict) -> dict:
+    payload = dict(payload, model=LLM_MODEL, stream=False, keep_alive=LLM_KEEP_ALIVE)
+    resp = get_session().post(f"{OLLAMA_HOST}/api/generate", json=payload, timeout=LLM_TIMEOUT)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def _prime_prefix(prefix: str, key):
+    """单独求值前缀，返回不含生成 token 的 context"""
+    body = _ollama_generate({"prompt": prefix, "raw": True, "options": {"num_predict": 1}})
+    context = body.get("context") or []
+    generated = body.get("eval_count") or 0
+    if generated:
+        context = context[:len(context) - generated]
+    prefix_cache.put(key, context)
+    with prefix_cache._lock:
+        prefix_cache.stats["primes"] += 1
+        prefix_cache.stats["prefix_eval_ms"] += (body.get("prompt_eval_duration") or 0) / 1e6
+    return context
+
+
+def generate_with_prefix(prefix: str, suffix: str, version: str, max_tokens: int = 256):
+    """
+    生成 prefix + suffix 的回答，返回 (输出文本, metrics)。
+    metrics 含 prompt_eval_ms / prompt_eval_tokens（Ollama 报告的 Prompt 求值耗时和 token 数）
+    以及 reused_prefix（是否复用了前缀的 context）。
+    """
+    start = time.perf_counter()
+    options = {"num_predict": max_tokens}
+    reused = False
+    if not LLM_PROMPT_TEMPLATE:
+        # 没有显式模板：不走 raw，让 Ollama 套用模型自带的对话模板（与不复用前缀时的输出一致）
+        payload = {"prompt": prefix + suffix, "options": options}
+    elif LLM_PREFIX_REUSE == "context":
+        head, _, tail = LLM_PROMPT_TEMPLATE.partition("{prompt}")
+        prefix, suffix = head + prefix, suffix + tail
+        key = prefix_cache.key(prefix, version)
+        context = prefix_cache.get(key)
+        if context is None:
+            with prefix_cache.prime_lock(key):
+                context = prefix_cache.get(key)
+                if context is None:
+                    context = _prime_prefix(prefix, key)
+        payload = {"prompt": suffix, "raw": True, "context": context, "options": options}
+        reused = bool(context)
+        if not reused:
+            payload = {"prompt": prefix + suffix, "raw": True, "options": options}
+    else:
+        head, _, tail = LLM_PROMPT_TEMPLATE.partition("{prompt}")
+        payload = {"prompt": head + prefix + suffix + tail, "raw": True, "options": options}
+
+    body = _ollama_generate(payload)
+    metrics = {
+        "mode": "stream",
+        "reused_prefix": reused,
+        "prompt_eval_tokens": body.get("prompt_eval_count") or 0,
+        "prompt_eval_ms": (body.get("prompt_eval_duration") or 0) / 1e6,
+        "tokens": body.get("eval_count"),
+        "total_ms": (time.perf_counter() - start) * 1000,
+    }
+    prefix_cache.record(metrics)
+    return body.get("response", ""), metrics
+
+
+# ==============================================================================
+# HTTP 会话：每个进程一个，prefork 的 worker 在 fork 之后需要调用 reset_session()
+# ==============================================================================
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = requests.Session()
+    return _session
+
+
+def reset_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def _expects_single_entity(question: str) -> bool:
+    """问题匹配到单答案模板（歌手/作词/专辑）时，回答只需要一个实体名"""
+    from handler import compiled_patterns, PAGINATED_QUERIES
+    for index, pattern in enumerate(compiled_patterns):
+        if pattern.match(question.strip()):
+            return index not in PAGINATED_QUERIES
+    return False
+
+
+def find_complete_entity(text: str, question: str, extractor, start: int = 0):
+    """
+    在流式输出中查找“已经完整”的 KG 实体：实体后面已经出现了别的字符，
+    且这个字符不会把它延长成词典中另一个更长的名字（如“周杰伦” vs “周杰伦的床边故事”）。
+    问题里出现过的实体（如被问的歌名）不算答案。返回实体结束位置，没有则返回 -1。
+    start 之前的位置不再检查（调用方保证这些位置在之前的调用中已经有定论）。
+    """
+    index = extractor.first_char_index
+    for i in range(start, len(text)):
+        for name in index.get(text[i], ()):
+            j = i + len(name)
+            if j >= len(text) or not text.startswith(name, i) or name in question:
+                continue
+            extended = text[i:j + 1]
+            if any(len(other) > len(name) and other.startswith(extended) for other in index[text[i]]):
+                continue
+            return j
+    return -1
+
+
+def _find_stop(text: str, stop, start: int = 0):
+    """返回最早出现的停止序列的位置，没有则返回 -1；只检查 start 之后新增的部分（回看一个停止序列的长度）"""
+    found = -1
+    for seq in stop or ():
+        pos = text.find(seq, max(0, start - len(seq) + 1))
+        if pos >= 0 and (found < 0 or pos < found):
+            found = pos
+    return found
+
+
+def _generate_streaming(question: str, prompt: str, max_tokens: int, stop, extractor=None):
+    """
+    流式读取 Ollama 输出，满足以下任一条件即停止：
+      - 单答案问题中检测到完整的 KG 实体（entity）
+      - 输出中出现停止序列（stop_sequence；在客户端匹配，才能和自然结束区分开）
+      - 达到 max_tokens（max_tokens）
+      - 模型自然结束（eos）
+    每收到一段输出只检查新增的尾部，整条回答的匹配开销与长度成线性关系。
+    """
+    if not _expects_single_entity(question):
+        extractor = None
+    elif extractor is None:
+        from entity_extractor import get_entity_extractor
+        extractor = get_entity_extractor()
+    max_name_len = 0
+    if extractor is not None:
+        # 每个首字的名字列表按长度降序，第一个即最长
+        max_name_len = max((len(names[0]) for names in extractor.first_char_index.values()), default=0)
+
+    payload = {
+        "model": LLM_MODEL,
+        "prompt": prompt,
+        "stream": True,
+        "options": {"num_predict": max_tokens},
+    }
+    metrics = {"mode": "stream", "tokens": 0, "ttft_ms": None, "stop_reason": None}
+    text = ""
+    scanned = 0
+    start = time.perf_counter()
+    try:
+        with get_session().post(f"{OLLAMA_HOST}/api/generate", json=payload,
+                                stream=True, timeout=LLM_TIMEOUT) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                piece = chunk.get("response", "")
+                if piece:
+                    if metrics["ttft_ms"] is None:
+                        metrics["ttft_ms"] = (time.perf_counter() - start) * 1000
+                    metrics["tokens"] += 1
+                    text += piece
+                    end = _find_stop(text, stop, scanned)
+                    if end >= 0:
+                        # 关闭连接即中止 Ollama 端的生成
+                        text = text[:end]
+                        metrics["stop_reason"] = "stop_sequence"
+                        break
+                if chunk.get("done"):
+                    metrics["tokens"] = chunk.get("eval_count", metrics["tokens"])
+                    metrics["stop_reason"] = "max_tokens" if chunk.get("done_reason") == "length" else "eos"
+                    break
+                if extractor is not None and piece:
+                    # 起点早于 len(text) - max_name_len 的实体在上一次检查时已经完整可判定
+                    end = find_complete_entity(text, question, extractor, max(0, scanned - max_name_len))
+                    if end >= 0:
+                        # 提前结束：关闭连接即中止 Ollama 端的生成
+                        text = text[:end]
+                        metrics["stop_reason"] = "entity"
+                        break
+                scanned = len(text)
+        answer = parse_llm_answer(text)
+    except Exception as e:
+        print(f"【LLM ERROR】{e}")
+        answer = "未知"
+        metrics["stop_reason"] = "error"
+    metrics["total_ms"] = (time.perf_counter() - start) * 1000
+    return answer, metrics
 
 
 def parse_llm_answer(text: str) -> str:
@@ -0,0 +1,340 @@
+# coding=utf-8
+"""
+压测工具：回放问题语料，测量 /query、/query_v2 的吞吐、错误率和延迟分布。
+
+语料格式（按扩展名识别）：
+  - .json   ：test_cases.json 格式（对象列表，取 question / llm_answer 字段）
+  - .jsonl  ：每行一个 {"question": ...} 对象
+  - 其他    ：纯文本日志，每行一个问题（兼容 handler 打印的 "问题： xxx" 行）
+
+目标：
+  - --target direct：进程内直接调用 query_handler / two_stage_qa
+  - --target http  ：请求 --url 指向的 app.py 服务；加 --serve 则在本进程内启动一个
+
+并发模型：
+  - closed（默认）：--concurrency 个 worker 循环发请求，上一个返回后才发下一个
+  - open          ：按 --rate 的固定到达率发请求，延迟从计划发出时刻算起（避免协同遗漏）
+
+替身（笔记本上无需 Neo4j / Ollama 也能跑）：
+  - --stub-graph：使用内存 SQLite 图后端（从 data/*.csv 加载）
+  - --stub-llm  ：LLM 调用替换为固定延迟的替身，回答取语料中记录的 llm_answer
+
+示例：
+    python loadtest.py test_cases.json --endpoint query_v2 --stub-graph --stub-llm --concurrency 8
+    python loadtest.py questions.log --target http --url http://127.0.0.1:5001 --mode open --rate 20
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext, redirect_stdout
+
+
+# ==============================================================================
+# 语料加载
+# ==============================================================================
+def load_corpus(path: str):
+    """读取问题语料，返回 [{"question": ..., "llm_answer": ...}, ...]"""
+    cases = []
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            for item in json.load(f):
+                cases.append({"question": item["question"], "llm_answer": item.get("llm_answer")})
+        elif path.endswith(".jsonl"):
+            for line in f:
+                line = line.strip()
+                if line:
+                    item = json.loads(line)
+                    cases.append({"question": item["question"], "llm_answer": item.get("llm_answer")})
+        else:
+            for line in f:
+                line = line.strip()
+                if line.startswith("问题："):
+                    line = line[len("问题："):].strip()
+                if line:
+                    cases.append({"question": line, "llm_answer": None})
+    return cases
+
+
+# ==============================================================================
+# 替身
+# ==============================================================================
+def install_stub_graph():
+    """必须在导入 handler / two_stage 之前调用"""
+    os.environ["KG_BACKEND"] = "sqlite"
+    os.environ["KG_SQLITE_PATH"] = ":memory:"
+
+
+def install_stub_llm(cases, latency_ms: float, extraction_latency_ms: float):
+    """把问答与抽取两处 LLM 调用替换为固定延迟的替身"""
+    import two_stage
+    import entity_extractor
+
+    recorded = {c["question"]: c["llm_answer"] for c in cases if c.get("llm_answer")}
+
+    def stub_generate_answer(question: str, **kwargs):
+        time.sleep(latency_ms / 1000)
+        return recorded.get(question, "未知"), {"mode": "stub", "total_ms": latency_ms}
+
+    def stub_generate_structured(question: str):
+        time.sleep(latency_ms / 1000)
+        answer = recorded.get(question, "未知")
+        return json.dumps({"answer": answer, "triples": []}, ensure_ascii=False), {"mode": "stub", "total_ms": latency_ms}
+
+    def stub_extraction(prompt: str, prefix: str = "", prefix_version: str = "") -> str:
+        time.sleep(extraction_latency_ms / 1000)
+        return ""  # 走轻量规则抽取
+
+    two_stage.generate_answer = stub_generate_answer
+    two_stage.generate_structured = stub_generate_structured
+    entity_extractor._call_llm_for_extraction = stub_extraction
+
+
+# ==============================================================================
+# 请求发送
+# ==============================================================================
+def make_direct_sender(endpoint: str):
+    if endpoint == "query":
+        from handler import query_handler
+        return lambda question: query_handler(question)
+    from two_stage import two_stage_qa
+    return lambda question: two_stage_qa(question)
+
+
+def make_http_sender(base_url: str, endpoint: str, timeout: float):
+    url = base_url.rstrip("/") + "/" + endpoint
+
+    def send(question):
+        body = json.dumps({"question": question}).encode("utf-8")
+        req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                return json.loads(resp.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(f"HTTP {e.code}") from e
+
+    return send
+
+
+def start_local_server():
+    """在后台线程中启动 app.py，返回 (base_url, server)"""
+    from werkzeug.serving import make_server
+    from app import app
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+# ==============================================================================
+# 负载驱动
+# ==============================================================================
+class Recorder:
+    def __init__(self):
+        self.latencies = []
+        self.errors = {}
+        self.app_errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, latency, error=None):
+        with self._lock:
+            if error is None:
+                self.latencies.append(latency)
+            else:
+                key = type(error).__name__ + ": " + str(error)[:80]
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def record_app_error(self, msg):
+        """请求本身成功（HTTP 200）但响应 state != 0，如模板未命中、内部出错"""
+        key = str(msg)[:80]
+        with self._lock:
+            self.app_errors[key] = self.app_errors.get(key, 0) + 1
+
+    @property
+    def error_count(self):
+        return sum(self.errors.values())
+
+    @property
+    def app_error_count(self):
+        return sum(self.app_errors.values())
+
+
+def _call(send, question, recorder, scheduled_at):
+    try:
+        res = send(question)
+        if isinstance(res, dict) and res.get("state", 0) != 0:
+            recorder.record_app_error(res.get("msg"))
+        else:
+            recorder.record(time.perf_counter() - scheduled_at)
+    except Exception as e:
+        recorder.record(time.perf_counter() - scheduled_at, error=e)
+
+
+def run_closed_loop(send, questions, total, concurrency, recorder):
+    counter = iter(range(total))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            _call(send, questions[i % len(questions)], recorder, time.perf_counter())
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def run_open_loop(send, questions, total, rate, max_inflight, recorder):
+    interval = 1.0 / rate
+    with ThreadPoolExecutor(max_workers=max_inflight) as pool:
+        start = time.perf_counter()
+        for i in range(total):
+            scheduled_at = start + i * interval
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(_call, send, questions[i % len(questions)], recorder, scheduled_at)
+
+
+# ==============================================================================
+# 报告
+# ==============================================================================
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def histogram(latencies, base_ms=1.0):
+    """按 1ms、2ms、4ms ... 的对数分桶，返回 [(上界ms, 数量), ...]"""
+    buckets = {}
+    for lat in latencies:
+        ms = lat * 1000
+        upper = base_ms
+        while ms > upper:
+            upper *= 2
+        buckets[upper] = buckets.get(upper, 0) + 1
+    return sorted(buckets.items())
+
+
+def build_report(recorder, total, elapsed):
+    lats = sorted(recorder.latencies)
+    return {
+        "requests": total,
+        "succeeded": len(lats),
+        "errors": recorder.error_count,
+        "app_errors": recorder.app_error_count,
+        "error_rate": (recorder.error_count + recorder.app_error_count) / total if total else 0.0,
+        "elapsed_s": elapsed,
+        "throughput_rps": len(lats) / elapsed if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "mean": sum(lats) / len(lats) * 1000 if lats else 0.0,
+            "p50": percentile(lats, 50) * 1000,
+            "p90": percentile(lats, 90) * 1000,
+            "p99": percentile(lats, 99) * 1000,
+            "max": lats[-1] * 1000 if lats else 0.0,
+        },
+        "histogram_ms": histogram(lats),
+        "error_types": recorder.errors,
+        "app_error_types": recorder.app_errors,
+    }
+
+
+def print_report(report):
+    lat = report["latency_ms"]
+    print(f"请求数      : {report['requests']}  (成功 {report['succeeded']}, 失败 {report['errors']}, "
+          f"state!=0 {report['app_errors']})")
+    print(f"错误率      : {report['error_rate'] * 100:.2f}%")
+    print(f"耗时        : {report['elapsed_s']:.2f} s")
+    print(f"吞吐        : {report['throughput_rps']:.2f} req/s")
+    print(f"延迟 (ms)   : mean {lat['mean']:.1f}  p50 {lat['p50']:.1f}  p90 {lat['p90']:.1f}  "
+          f"p99 {lat['p99']:.1f}  max {lat['max']:.1f}")
+    print("延迟直方图 :")
+    peak = max((count for _, count in report["histogram_ms"]), default=0)
+    for upper, count in report["histogram_ms"]:
+        bar = "#" * max(1, round(40 * count / peak))
+        print(f"  <= {upper:8.0f} ms | {count:6d} {bar}")
+    for err, count in report["error_types"].items():
+        print(f"  错误 x{count}: {err}")
+    for msg, count in report["app_error_types"].items():
+        print(f"  state!=0 x{count}: {msg}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放问题语料压测 /query 与 /query_v2")
+    parser.add_argument("corpus", help="问题语料（test_cases.json / .jsonl / 纯文本日志）")
+    parser.add_argument("--endpoint", choices=["query", "query_v2"], default="query")
+    parser.add_argument("--target", choices=["direct", "http"], default="direct")
+    parser.add_argument("--url", default="http://127.0.0.1:5001", help="http 目标的服务地址")
+    parser.add_argument("--serve", action="store_true", help="在本进程内启动 app.py 作为 http 目标")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+    parser.add_argument("--concurrency", type=int, default=4, help="closed 模式的并发数")
+    parser.add_argument("--rate", type=float, default=10.0, help="open 模式每秒请求数")
+    parser.add_argument("--max-inflight", type=int, default=256, help="open 模式最大在途请求数")
+    parser.add_argument("--requests", type=int, default=None, help="总请求数（默认回放语料一遍）")
+    parser.add_argument("--timeout", type=float, default=120.0, help="http 请求超时（秒）")
+    parser.add_argument("--stub-graph", action="store_true", help="使用内存 SQLite 图替身")
+    parser.add_argument("--stub-llm", action="store_true", help="使用固定延迟的 LLM 替身")
+    parser.add_argument("--llm-latency", type=float, default=200.0, help="LLM 替身回答延迟（ms）")
+    parser.add_argument("--extraction-latency", type=float, default=100.0, help="LLM 替身抽取延迟（ms）")
+    parser.add_argument("--verbose", action="store_true", help="保留被测代码的控制台输出")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出报告")
+    args = parser.parse_args()
+
+    cases = load_corpus(args.corpus)
+    if not cases:
+        parser.error("语料为空")
+    questions = [c["question"] for c in cases]
+    total = args.requests or len(questions)
+
+    if args.stub_graph:
+        install_stub_graph()
+    if args.stub_llm:
+        install_stub_llm(cases, args.llm_latency, args.extraction_latency)
+
+    if args.target == "http":
+        url = args.url
+        if args.serve:
+            url, _ = start_local_server()
+        send = make_http_sender(url, args.endpoint, args.timeout)
+    else:
+        send = make_direct_sender(args.endpoint)
+
+    recorder = Recorder()
+    devnull = open(os.devnull, "w", encoding="utf-8")
+    with nullcontext() if args.verbose else redirect_stdout(devnull):
+        # 预热：加载实体词典 / 建立连接，不计入结果
+        try:
+            send(questions[0])
+        except Exception:
+            pass
+        start = time.perf_counter()
+        if args.mode == "closed":
+            run_closed_loop(send, questions, total, args.concurrency, recorder)
+        else:
+            run_open_loop(send, questions, total, args.rate, args.max_inflight, recorder)
+        elapsed = time.perf_counter() - start
+    devnull.close()
+
+    report = build_report(recorder, total, elapsed)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+# coding=utf-8
+"""
+按需性能剖析（调试用，默认关闭）。
+
+开启：KG_PROFILING=1，并设置 KG_PROFILING_TOKEN（请求头 X-Profile-Token 必须一致）。
+未开启时不注册任何路由和钩子，各处的 stage() 标记直接返回空上下文，几乎没有开销。
+
+    POST /debug/profile/start   {"requests": 20}            剖析接下来的 20 个请求
+                                {"seconds": 30}             或剖析接下来 30 秒内开始的请求
+                                "kind": "cprofile"|"sample"   cProfile 按函数统计 / 定时采样调用栈
+                                "memory": true              同时用 tracemalloc 记录内存分配
+                                "interval_ms": 5            采样间隔（仅 sample）
+    GET  /debug/profile/result?format=stats|collapsed
+        stats：按函数汇总的耗时、各阶段（stage）墙钟/CPU 耗时、内存分配 Top N
+        collapsed：折叠调用栈文本（"a;b;c 次数"），可直接交给 flamegraph.pl / speedscope（仅 sample）
+
+cProfile 在同一时刻只能剖析一个请求（并发请求会被跳过并计入 skipped）；sample 模式无此限制。
+"""
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+PROFILING_ENABLED = os.getenv("KG_PROFILING", "0") == "1"
+PROFILING_TOKEN = os.getenv("KG_PROFILING_TOKEN", "")
+TOP_N = 50
+
+_local = threading.local()
+_NULL_STAGE = nullcontext()
+_session = None
+_session_lock = threading.Lock()
+
+
+class _Stage:
+    def __init__(self, session, name):
+        self.session = session
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+
+    def __exit__(self, *exc):
+        self.session.add_stage(
+            self.name,
+            (time.perf_counter() - self.wall) * 1000,
+            (time.thread_time() - self.cpu) * 1000
+        )
+
+
+def stage(name):
+    """标记请求内的一个阶段（LLM、抽取、Cypher 等）；当前请求未被剖析时为空操作"""
+    session = getattr(_local, "session", None)
+    if session is None:
+        return _NULL_STAGE
+    return _Stage(session, name)
+
+
+class ProfileSession:
+    def __init__(self, kind="cprofile", requests=None, seconds=None, memory=False, interval_ms=5):
+        if kind not in ("cprofile", "sample"):
+            raise ValueError("kind 必须是 cprofile 或 sample")
+        if requests is None and seconds is None:
+            raise ValueError("需要指定 requests 或 seconds")
+        if requests is not None and (isinstance(requests, bool) or int(requests) < 1):
+            raise ValueError("requests 必须是不小于 1 的整数")
+        if seconds is not None and (isinstance(seconds, bool) or float(seconds) <= 0):
+            raise ValueError("seconds 必须大于 0")
+        self.kind = kind
+        self.remaining = int(requests) if requests is not None else None
+        self.deadline = time.monotonic() + float(seconds) if seconds is not None else None
+        self.memory = memory
+        self.interval = max(float(interval_ms), 1.0) / 1000
+        self.started_at = time.time()
+        self.finished = False
+        self.profiled = 0
+        self.skipped = 0
+        self.stages = {}
+        self.stats = None
+        self.samples = {}
+        self.memory_top = []
+        self._lock = threading.Lock()
+        self._cprofile_busy = threading.Lock()
+        self._active_threads = set()
+        self._memory_start = None
+        self._owns_tracemalloc = False  # 只停止由本次剖析启动的 tracemalloc
+        if memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(25)
+                self._owns_tracemalloc = True
+            self._memory_start = tracemalloc.take_snapshot()
+        if kind == "sample":
+            self._sampler = threading.Thread(target=self._sample_loop, name="kg-profile-sampler", daemon=True)
+            self._sampler.start()
+
+    # ---------- 请求生命周期 ----------
+    def _accepting(self):
+        if self.finished:
+            return False
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return False
+        return self.remaining is None or self.remaining > 0
+
+    def begin_request(self):
+        """请求开始时调用；返回该请求的剖析句柄，不剖析时返回 None"""
+        with self._lock:
+            if not self._accepting():
+                return None
+            if self.kind == "cprofile" and not self._cprofile_busy.acquire(blocking=False):
+                self.skipped += 1
+                return None
+            if self.remaining is not None:
+                self.remaining -= 1
+            self._active_threads.add(threading.get_ident())
+        profiler = None
+        if self.kind == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+        _local.session = self
+        return profiler
+
+    def end_request(self, profiler):
+        _local.session = None
+        if profiler is not None:
+            profiler.disable()
+        with self._lock:
+            self._active_threads.discard(threading.get_ident())
+            self.profiled += 1
+            if profiler is not None:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profiler)
+                else:
+                    self.stats.add(profiler)
+            done = not self._accepting() and not self._active_threads
+        if self.kind == "cprofile":
+            self._cprofile_busy.release()
+        if done:
+            self.finish()
+
+    def add_stage(self, name, wall_ms, cpu_ms):
+        with self._lock:
+            entry = self.stages.setdefault(name, {"count": 0, "wall_ms": 0.0, "cpu_ms": 0.0})
+            entry["count"] += 1
+            entry["wall_ms"] += wall_ms
+            entry["cpu_ms"] += cpu_ms
+
+    def expire(self):
+        """时间窗口已过且没有进行中的请求时结束会话"""
+        if self.deadline is not None and time.monotonic() >= self.deadline and not self._active_threads:
+            self.finish()
+
+    def finish(self):
+        with self._lock:
+            if self.finished:
+                return
+            self.finished = True
+        if self.memory and self._memory_start is not None:
+            diff = tracemalloc.take_snapshot().compare_to(self._memory_start, "lineno")
+            self.memory_top = [
+                {
+                    "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                    "size_kb": round(stat.size_diff / 1024, 1),
+                    "count": stat.count_diff,
+                }
+                for stat in diff[:TOP_N]
+            ]
+            if self._owns_tracemalloc:
+                tracemalloc.stop()
+
+    # ---------- 采样 ----------
+    def _sample_loop(self):
+        while not self.finished:
+            self.expire()
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self._active_threads)
+            for tid in threads:
+                frame = frames.get(tid)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                with self._lock:
+                    self.samples[key] = self.samples.get(key, 0) + 1
+            time.sleep(self.interval)
+
+    # ---------- 结果 ----------
+    def _function_stats(self):
+        if self.kind == "sample":
+            # 采样模式：按函数统计自身/累计出现次数
+            own, total = {}, {}
+            for key, count in self.samples.items():
+                frames = key.split(";")
+                own[frames[-1]] = own.get(frames[-1], 0) + count
+                for name in set(frames):
+                    total[name] = total.get(name, 0) + count
+            rows = sorted(total.items(), key=lambda kv: kv[1], reverse=True)[:TOP_N]
+            return [
+                {"function": name, "self_samples": own.get(name, 0), "total_samples": count}
+                for name, count in rows
+            ]
+        if self.stats is None:
+            return []
+        rows = []
+        for (filename, line, func), (cc, nc, tt, ct, _) in self.stats.stats.items():
+            rows.append({
+                "function": f"{os.path.basename(filename)}:{line}({func})",
+                "ncalls": nc,
+                "tottime_ms": round(tt * 1000, 3),
+                "cumtime_ms": round(ct * 1000, 3),
+            })
+        rows.sort(key=lambda r: r["cumtime_ms"], reverse=True)
+        return rows[:TOP_N]
+
+    def report(self):
+        with self._lock:
+            stages = {
+                name: {
+                    "count": s["count"],
+                    "wall_ms": round(s["wall_ms"], 3),
+                    "cpu_ms": round(s["cpu_ms"], 3),
+                    "mean_wall_ms": round(s["wall_ms"] / s["count"], 3),
+                }
+                for name, s in self.stages.items()
+            }
+        return {
+            "kind": self.kind,
+            "finished": self.finished,
+            "profiled_requests": self.profiled,
+            "skipped_requests": self.skipped,
+            "started_at": self.started_at,
+            "functions": self._function_stats(),
+            "stages": stages,
+            "memory": self.memory_top,
+        }
+
+    def collapsed(self):
+        with self._lock:
+            items = sorted(self.samples.items(), key=lambda kv: kv[1], reverse=True)
+        out = io.StringIO()
+        for key, count in items:
+            out.write(f"{key} {count}\n")
+        return out.getvalue()
+
+
+def start_session(**kwargs):
+    global _session
+    with _session_lock:
+        if _session is not None and not _session.finished:
+            raise ValueError("已有进行中的剖析会话")
+        _session = ProfileSession(**kwargs)
+        return _session
+
+
+def current_session():
+    return _session
+
+
+def register_profiling(app):
+    """KG_PROFILING=1 时为 Flask 应用注册剖析路由与请求钩子"""
+    if not PROFILING_ENABLED:
+        return
+    if not PROFILING_TOKEN:
+        print("[PROFILING] 未设置 KG_PROFILING_TOKEN，剖析接口不启用")
+        return
+
+    from flask import g, jsonify, request, Response
+
+    def authorized():
+        return hmac.compare_digest(request.headers.get("X-Profile-Token", "").encode("utf-8"),
+                                   PROFILING_TOKEN.encode("utf-8"))
+
+    @app.before_request
+    def _profile_begin():
+        session = _session
+        if session is None or session.finished or request.path.startswith("/debug/profile"):
+            return
+        g.kg_profile = (session, session.begin_request())
+
+    @app.teardown_request
+    def _profile_end(exc):
+        handle = g.pop("kg_profile", None)
+        if handle is not None and getattr(_local, "session", None) is handle[0]:
+            handle[0].end_request(handle[1])
+
+    @app.route('/debug/profile/start', methods=['POST'])
+    def profile_start():
+        if not authorized():
+            return jsonify({"state": 1, "msg": "无权限"}), 403
+        data = request.get_json(silent=True) or {}
+        try:
+            session = start_session(
+                kind=data.get("kind", "cprofile"),
+                requests=data.get("requests"),
+                seconds=data.get("seconds"),
+                memory=bool(data.get("memory")),
+                interval_ms=data.get("interval_ms", 5)
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({"state": 1, "msg": str(e)}), 400
+        return jsonify({"state": 0, "kind": session.kind, "msg": "剖析已开始"})
+
+    @app.route('/debug/profile/result', methods=['GET'])
+    def profile_result():
+        if not authorized():
+            return jsonify({"state": 1, "msg": "无权限"}), 403
+        session = _session
+        if session is None:
+            return jsonify({"state": 1, "msg": "没有剖析会话"}), 404
+        if request.args.get("stop") == "1":
+            session.finish()
+        else:
+            session.expire()
+        if request.args.get("format") == "collapsed":
+            if session.kind != "sample":
+                return jsonify({"state": 1, "msg": "collapsed 格式需要 kind=sample"}), 400
+            return Response(session.collapsed(), mimetype="text/plain")
+        return jsonify({"state": 0, "data": session.report()})
@@ -0,0 +1,116 @@
+# coding=utf-8
+"""
+KG 模板查询结果的读穿缓存（/query 与 two_stage 第 3 步都经过 handler._run_template）。
+
+- 键：(数据范围, 图数据版本, 模板下标, 实体, 分页游标 after, 取回条数)。数据范围为后端名，
+  分片部署时为参与查询的分片名；版本为后端的 graph_version()，分片部署时为路由索引中记录的分片版本
+- 失效：导入脚本 / bulk_load 每次导入后递增图数据版本（Neo4j 的 :_KGMeta 节点、SQLite 的 meta 表、
+  分片路由索引的 versions 表），版本号本身按 QUERY_CACHE_VERSION_TTL 秒缓存；发现版本变化时丢弃该范围的旧条目。
+- 代价与时效：命中时不访问数据库；只有版本 TTL 过期后的那一次请求重新读取版本（单后端部署为一次
+  Neo4j 往返或本地 SQLite 查询，分片部署为一次路由索引查询，都不加载分片），其余并发请求在读取期间
+  继续使用旧版本号。因此导入完成后，每个进程最多还会有 QUERY_CACHE_VERSION_TTL 秒返回旧结果；
+  需要立即生效时设 QUERY_CACHE_VERSION_TTL=0（每次查询都读取版本）
+- 正向结果放在 QUERY_CACHE_SIZE 条的 LRU 中；空结果（负缓存）单独放在 QUERY_CACHE_NEGATIVE_SIZE 条的 LRU 中，
+  另有 QUERY_CACHE_NEGATIVE_TTL 秒过期，避免大量不存在的实体把正向结果挤出去
+- QUERY_CACHE_SIZE=0 关闭缓存
+"""
+import os
+import threading
+import time
+
+from cache import LRUCache
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "4096"))
+QUERY_CACHE_NEGATIVE_SIZE = int(os.getenv("QUERY_CACHE_NEGATIVE_SIZE", "1024"))
+QUERY_CACHE_NEGATIVE_TTL = float(os.getenv("QUERY_CACHE_NEGATIVE_TTL", "300"))
+QUERY_CACHE_VERSION_TTL = float(os.getenv("QUERY_CACHE_VERSION_TTL", "5"))
+
+
+class QueryResultCache:
+    def __init__(self, maxsize: int = QUERY_CACHE_SIZE, negative_maxsize: int = QUERY_CACHE_NEGATIVE_SIZE,
+                 negative_ttl: float = QUERY_CACHE_NEGATIVE_TTL, version_ttl: float = QUERY_CACHE_VERSION_TTL):
+        self.enabled = maxsize > 0
+        self.negative_ttl = negative_ttl
+        self.version_ttl = version_ttl
+        self._positive = LRUCache(maxsize)
+        self._negative = LRUCache(negative_maxsize)
+        self._versions = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.negative_hits = 0
+        self.invalidations = 0
+
+    def version(self, scope: str, load) -> str:
+        """
+        范围 scope 的图数据版本；load() 读取实际版本，结果缓存 version_ttl 秒。
+        过期后只由一个线程调用 load()，同时到达的其他请求沿用旧版本，不会一起访问数据库
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._versions.get(scope)
+            if cached is not None and (now - cached[1] < self.version_ttl or scope in self._refreshing):
+                return cached[0]
+            self._refreshing.add(scope)
+        try:
+            version = load()
+        finally:
+            with self._lock:
+                self._refreshing.discard(scope)
+        with self._lock:
+            self._versions[scope] = (version, time.monotonic())
+        if cached is not None and cached[0] != version:
+            self._drop_scope(scope)
+        return version
+
+    def _drop_scope(self, scope: str):
+        """图数据版本变化后，丢弃涉及该范围的旧条目（新版本的键不会再命中它们）"""
+        with self._lock:
+            self.invalidations += 1
+        for store in (self._positive, self._negative):
+            for key, _ in store.items():
+                if scope in key[0]:
+                    store.pop(key)
+
+    def get_or_run(self, scopes, query_key: tuple, run) -> tuple:
+        """
+        scopes: [(范围名, 读取版本的函数), ...]；query_key: (模板下标, 实体, after, 取回条数)
+        run(): 缓存未命中时实际执行查询，返回排序键列表
+        """
+        if not self.enabled:
+            return tuple(run())
+        names = tuple(name for name, _ in scopes)
+        versions = tuple(self.version(name, load) for name, load in scopes)
+        key = (names, versions) + tuple(query_key)
+
+        rows = self._positive.get(key)
+        if rows is not None:
+            return rows
+        expires = self._negative.get(key)
+        if expires is not None:
+            if time.monotonic() < expires:
+                with self._lock:
+                    self.negative_hits += 1
+                return ()
+            self._negative.pop(key)
+
+        rows = tuple(run())
+        if rows:
+            self._positive.put(key, rows)
+        else:
+            self._negative.put(key, time.monotonic() + self.negative_ttl)
+        return rows
+
+    def clear(self):
+        self._positive.clear()
+        self._negative.clear()
+        with self._lock:
+            self._versions.clear()
+            self._refreshing.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            extra = {"negative_hits": self.negative_hits, "invalidations": self.invalidations}
+        return dict(self._positive.stats(), negative=self._negative.stats(), **extra)
+
+
+query_cache = QueryResultCache()
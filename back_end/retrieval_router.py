@@ -0,0 +1,228 @@
+# coding=utf-8
+"""
+检索式路由 —— 问句没有命中 handler.patterns 中任何正则时的兜底。
+
+做法（纯 CPU，约 1ms）：
+  1. 在问句中找 KG 实体：先按词典做最长精确匹配；找不到时，用字符 n-gram TF-IDF
+     把问句的各个子串与全部实体名比对，取余弦相似度最高的一对（容忍错别字/多余字）
+  2. 把实体所在位置替换成占位符 @，得到“问法”，与每个模板的若干同义问法
+     （同样是字符 n-gram TF-IDF 向量）算余弦相似度
+  3. 实体类型与模板槽位类型一致、问句（去掉实体后）含有该模板的关系关键词、得分不低于阈值，
+     且不比“不支持的问法”（作曲、发行时间、演唱会门票等 KG 中没有的关系）更接近时，返回 (模板下标, 实体, 得分)
+
+依赖 numpy / scipy（可选）；未安装时路由器不可用，query_handler 按原逻辑返回匹配失败。
+"""
+import math
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # 可选依赖
+    np = None
+    sparse = None
+
+SLOT = "@"
+
+# 模板下标 → 槽位实体类型（与 handler.patterns 对应；7~10 与 0~2 语义重复，不单独列出）
+SLOT_LABELS = {0: "作品", 1: "作品", 2: "作品", 3: "专辑", 4: "人物", 5: "人物", 6: "人物"}
+
+# 模板下标 → 同义问法（@ 为实体位置）
+TEMPLATE_PARAPHRASES = {
+    0: ["歌曲@所属的音乐专辑是", "@是哪个专辑的", "@属于哪张专辑", "@是哪张专辑里的歌",
+        "@收录在哪张专辑", "@出自哪张专辑", "@的专辑是什么"],
+    1: ["歌曲@的作词人是", "谁作词的@", "@的词是谁写的", "@的作词是谁", "谁写了@的歌词", "@的歌词作者是谁"],
+    2: ["演唱@的歌手是", "@是谁唱的", "谁唱的@", "@的演唱者是谁", "@是谁演唱的", "谁演唱了@", "@的原唱是谁"],
+    3: ["专辑@包含的歌曲是", "@这张专辑有哪些歌", "@专辑里有什么歌", "专辑@的曲目", "@收录了哪些歌曲",
+        "@专辑里的歌曲有哪些"],
+    4: ["@演唱的歌曲有", "@唱过哪些歌", "@有哪些歌", "@的歌曲有哪些", "@演唱过什么歌"],
+    5: ["@作词的歌曲有", "@写过哪些歌词", "@作词的歌有哪些", "@填词的歌曲", "@写词的歌有什么"],
+    6: ["@合作过的人有", "@和谁合作过", "@的合作者有哪些", "和@合作的人", "@跟哪些人合作过"],
+}
+
+# 模板下标 → 关系关键词：去掉实体后的问句至少要含其中一个，避免只凭句式相近就路由到别的关系
+TEMPLATE_KEYWORDS = {
+    0: ("专辑",),
+    1: ("词",),
+    2: ("唱", "歌手"),
+    3: ("歌", "曲目"),
+    4: ("唱", "歌"),
+    5: ("词",),
+    6: ("合作",),
+}
+
+# KG 中没有的关系的问法：问句与这些问法最接近时不路由（交给 LLM 回答）
+UNSUPPORTED_PARAPHRASES = [
+    "@的作曲是谁", "谁作曲的@", "@是谁作曲的", "@的曲是谁写的", "@的编曲是谁",
+    "@是什么时候发行的", "@的发行时间", "@哪一年发行", "@的发行日期是",
+    "@演唱会门票多少钱", "@的演唱会门票", "@演唱会在哪里", "@的演唱会什么时候",
+    "@有多长", "@的MV是谁拍的", "@多大了", "@的生日是",
+]
+UNSUPPORTED = -1
+
+ROUTER_THRESHOLD = float(os.getenv("ROUTER_THRESHOLD", "0.5"))
+ENTITY_THRESHOLD = float(os.getenv("ROUTER_ENTITY_THRESHOLD", "0.6"))
+MAX_ENTITY_WINDOW = 20
+
+
+def available() -> bool:
+    return np is not None
+
+
+class CharNgramTfidf:
+    """字符 n-gram TF-IDF 向量化（sublinear tf + 平滑 idf + L2 归一化）"""
+
+    def __init__(self, ngram_range=(1, 3)):
+        self.ngram_range = ngram_range
+        self.vocab: Dict[str, int] = {}
+        self.idf = None
+
+    def _ngrams(self, text: str) -> Dict[str, int]:
+        counts = {}
+        lo, hi = self.ngram_range
+        for n in range(lo, hi + 1):
+            for i in range(len(text) - n + 1):
+                gram = text[i:i + n]
+                counts[gram] = counts.get(gram, 0) + 1
+        return counts
+
+    def fit(self, docs: List[str]):
+        df = {}
+        for doc in docs:
+            for gram in self._ngrams(doc):
+                df[gram] = df.get(gram, 0) + 1
+        self.vocab = {gram: i for i, gram in enumerate(df)}
+        n = len(docs)
+        self.idf = np.array([math.log((1 + n) / (1 + df[g])) + 1 for g in self.vocab], dtype=np.float64)
+        return self
+
+    def transform(self, docs: List[str]):
+        rows, cols, vals = [], [], []
+        for r, doc in enumerate(docs):
+            for gram, count in self._ngrams(doc).items():
+                c = self.vocab.get(gram)
+                if c is not None:
+                    rows.append(r)
+                    cols.append(c)
+                    vals.append((1 + math.log(count)) * self.idf[c])
+        m = sparse.csr_matrix((vals, (rows, cols)), shape=(len(docs), len(self.vocab)), dtype=np.float64)
+        norms = np.sqrt(np.asarray(m.multiply(m).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        return sparse.diags(1.0 / norms) @ m
+
+
+class TemplateRouter:
+    def __init__(self, extractor):
+        self.extractor = extractor
+        self.labels_by_name: Dict[str, set] = {}
+        for label, names in (("作品", extractor.songs), ("专辑", extractor.albums), ("人物", extractor.persons)):
+            for name in names:
+                self.labels_by_name.setdefault(name, set()).add(label)
+
+        self.template_ids = []
+        phrases = []
+        for index, items in list(TEMPLATE_PARAPHRASES.items()) + [(UNSUPPORTED, UNSUPPORTED_PARAPHRASES)]:
+            for phrase in items:
+                self.template_ids.append(index)
+                phrases.append(phrase)
+        self.template_ids = np.array(self.template_ids)
+        self.template_vec = CharNgramTfidf((1, 3)).fit(phrases)
+        self.template_matrix = self.template_vec.transform(phrases).T.tocsr()
+
+        self.entity_names = list(self.labels_by_name)
+        self.entity_vec = CharNgramTfidf((1, 2)).fit(self.entity_names) if self.entity_names else None
+        self.entity_matrix = (
+            self.entity_vec.transform(self.entity_names).T.tocsr() if self.entity_names else None
+        )
+
+    # ---------- 实体 ----------
+    def _exact_entity(self, question: str) -> Optional[Tuple[str, int, int]]:
+        best = None
+        index = self.extractor.first_char_index
+        for i, ch in enumerate(question):
+            for name in index.get(ch, ()):
+                if question.startswith(name, i):
+                    if best is None or len(name) > best[2] - best[1]:
+                        best = (name, i, i + len(name))
+                    break  # 同一起点上名字按长度降序，第一个即最长
+        return best
+
+    def _fuzzy_entity(self, question: str) -> Optional[Tuple[str, int, int, float]]:
+        if self.entity_matrix is None:
+            return None
+        spans = [(i, j) for i in range(len(question))
+                 for j in range(i + 2, min(len(question), i + MAX_ENTITY_WINDOW) + 1)]
+        if not spans:
+            return None
+        windows = self.entity_vec.transform([question[i:j] for i, j in spans])
+        scores = (windows @ self.entity_matrix).toarray()
+        w, e = np.unravel_index(np.argmax(scores), scores.shape)
+        score = float(scores[w, e])
+        if score < ENTITY_THRESHOLD:
+            return None
+        i, j = spans[w]
+        return self.entity_names[e], i, j, score
+
+    # ---------- 模板 ----------
+    def route(self, question: str) -> Optional[dict]:
+        """返回 {"template", "entity", "score", "entity_score"}；无法可靠路由时返回 None"""
+        question = question.strip()
+        found = self._exact_entity(question)
+        entity_score = 1.0
+        if found is None:
+            fuzzy = self._fuzzy_entity(question)
+            if fuzzy is None:
+                return None
+            entity, start, end, entity_score = fuzzy
+        else:
+            entity, start, end = found
+
+        masked = question[:start] + SLOT + question[end:]
+        scores = (self.template_vec.transform([masked]) @ self.template_matrix).toarray().ravel()
+        labels = self.labels_by_name.get(entity, set())
+        best_index, best_score = None, 0.0
+        unsupported_score = 0.0
+        for col in np.argsort(-scores):
+            index = int(self.template_ids[col])
+            if index == UNSUPPORTED:
+                unsupported_score = max(unsupported_score, float(scores[col]))
+            elif SLOT_LABELS[index] in labels and any(k in masked for k in TEMPLATE_KEYWORDS[index]):
+                best_index, best_score = index, float(scores[col])
+                break
+        if best_index is None or best_score < ROUTER_THRESHOLD or unsupported_score >= best_score:
+            return None
+        return {"template": best_index, "entity": entity, "score": best_score, "entity_score": entity_score}
+
+
+# ==============================================================================
+# 单例：基于实体抽取器的词典构建，词典重新加载时重建
+# ==============================================================================
+_router_instance = None
+_router_lock = threading.Lock()
+
+
+def _invalidate(*_):
+    global _router_instance
+    _router_instance = None
+
+
+def get_router() -> Optional[TemplateRouter]:
+    """获取路由器单例；缺少 numpy/scipy 时返回 None"""
+    global _router_instance
+    if not available():
+        return None
+    if _router_instance is None:
+        with _router_lock:
+            if _router_instance is None:
+                from entity_extractor import get_entity_extractor
+                extractor = get_entity_extractor()
+                extractor.on_reload(_invalidate)
+                _router_instance = TemplateRouter(extractor)
+    return _router_instance
+
+
+def route_question(question: str) -> Optional[dict]:
+    router = get_router()
+    return router.route(question) if router is not None else None
@@ -0,0 +1,139 @@
+# coding=utf-8
+"""
+生产模式入口：prefork 多进程服务。
+
+父进程预加载 Flask app、实体词典和预编译的模板正则，然后 fork 出多个 worker，
+worker 通过写时复制共享这部分内存。每个 worker 在 fork 之后重新创建自己的
+图数据库连接（Neo4j driver / SQLite 连接）和 LLM 的 HTTP 会话，不与父进程或其他 worker 共用。
+
+用法：
+    python serve.py --workers 4 --port 5001
+    python serve.py --workers 0            # 0 表示按 CPU 核数
+
+Windows 不支持 fork，会退化为单进程运行。
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+from werkzeug.serving import make_server
+
+
+def preload():
+    """在父进程中加载所有可共享的只读数据"""
+    from app import app
+    import handler  # 导入即编译模板正则
+    from entity_extractor import get_entity_extractor
+    from graph_backend import reset_backend
+
+    get_entity_extractor().first_char_index  # 流式提前停止用的首字索引
+    if handler.ROUTER_ENABLED:
+        from retrieval_router import get_router
+        get_router()  # 检索路由的 TF-IDF 矩阵
+    # 父进程里建立的连接不能跨 fork 使用，预加载完就关掉
+    reset_backend()
+    return app
+
+
+def post_fork():
+    """worker 进程启动后调用：重建进程私有的连接"""
+    from graph_backend import reset_backend
+    from llm import reset_session
+    from shards import reset_shard_manager
+    reset_backend()
+    reset_session()
+    reset_shard_manager()
+
+
+def run_worker(app, sock, threaded):
+    post_fork()
+    signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, app, threaded=threaded, fd=sock.fileno())
+    server.serve_forever()
+
+
+def spawn_worker(app, sock, threaded):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_worker(app, sock, threaded)
+        finally:
+            os._exit(1)
+    return pid
+
+
+def serve(host, port, workers, threaded):
+    app = preload()
+
+    if not hasattr(os, "fork"):
+        print("当前平台不支持 fork，以单进程模式运行")
+        app.run(host=host, port=port, threaded=threaded)
+        return
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+
+    # 把预加载的对象移出 GC 追踪范围，避免 worker 里的 GC 触碰这些页面导致复制
+    gc.freeze()
+
+    children = {spawn_worker(app, sock, threaded) for _ in range(workers)}
+    print(f"prefork 服务已启动: http://{host}:{sock.getsockname()[1]} ({workers} workers, pid {os.getpid()})")
+
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            print(f"worker {pid} 退出 (status {status})，重新拉起")
+            time.sleep(0.5)
+            children.add(spawn_worker(app, sock, threaded))
+    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="prefork 多进程服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("KG_WORKERS", "0")),
+                        help="worker 进程数，0 表示按 CPU 核数")
+    parser.add_argument("--threads", action="store_true", help="每个 worker 内部再用线程处理请求")
+    args = parser.parse_args()
+
+    workers = args.workers or os.cpu_count() or 1
+    from admission import ADMISSION_ENABLED, ADMISSION_STORE
+    if workers > 1 and ADMISSION_ENABLED and not ADMISSION_STORE:
+        # 进程内令牌桶按 worker 各算各的，实际额度会放大 workers 倍
+        parser.error("多 worker 开启准入控制时必须设置 ADMISSION_STORE（共享的 SQLite 令牌桶）")
+    serve(args.host, args.port, workers, args.threads)
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
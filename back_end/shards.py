@@ -0,0 +1,398 @@
+# coding=utf-8
+"""
+多歌手曲库分片。
+
+每个分片是 KG_SHARDS_DIR 下的一个子目录（如 data/shards/jay-chou/），内含与 data/ 相同的
+专辑.csv / 音乐作品.csv / 人物.csv / relation.csv，并拥有：
+  - 自己的图后端：sqlite 为 <分片目录>/kg.sqlite3（为空时从该目录的 CSV 加载），
+    neo4j 为与分片同名的数据库（分片名需符合 Neo4j 数据库命名：小写字母、数字、点、短横线）
+  - 自己的实体词典（MusicEntityExtractor）和检索路由器
+
+分片按需加载，最多同时保留 KG_MAX_LOADED_SHARDS 个（LRU 淘汰，淘汰时关闭后端连接、释放词典）。
+实体名 → 分片的路由索引存放在磁盘上的 <KG_SHARDS_DIR>/routing.sqlite3 中，不随分片数量占用内存，
+查找为一次 B-tree 检索。同一文件里还记录每个分片的数据版本（重建索引时分片 CSV 的内容摘要有变化、或导入脚本 --shard 导入后，
+在原版本上链式推进，不会退回旧值），查询结果缓存据此校验分片版本，不需要加载分片。
+新增或更新分片数据后重建索引：
+
+    python shards.py build-index
+
+未设置 KG_SHARDS_DIR 时不启用分片，沿用 graph_backend.get_backend() 的单图部署。
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from cache import LRUCache
+from csv_preflight import NODE_FILES, RELATION_FILE
+from graph_backend import ENTITY_LABELS, create_backend, read_csv_graph
+
+SHARDS_DIR = os.getenv("KG_SHARDS_DIR", "")
+MAX_LOADED_SHARDS = int(os.getenv("KG_MAX_LOADED_SHARDS", "4"))
+ROUTING_INDEX_FILE = "routing.sqlite3"
+# 在问句中查找实体时考虑的子串长度范围；问句只看前 MAX_QUESTION_LEN 个字，单次查找的工作量有上界
+MIN_ENTITY_LEN = 2
+MAX_ENTITY_LEN = 20
+MAX_QUESTION_LEN = 64
+# 每条 SQL 绑定的候选数（低于旧版 SQLite 999 个参数的上限）
+LOOKUP_BATCH = 500
+
+
+def sharding_enabled() -> bool:
+    return bool(SHARDS_DIR)
+
+
+class Shard:
+    """一个分片：图后端、实体词典、检索路由器都在首次使用时创建"""
+
+    def __init__(self, name: str, data_dir: str):
+        self.name = name
+        self.data_dir = data_dir
+        self._backend = None
+        self._extractor = None
+        self._router = None
+        self._lock = threading.Lock()
+        self._users = 0
+        self._evicted = False
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = create_backend(
+                        sqlite_path=os.path.join(self.data_dir, "kg.sqlite3"),
+                        data_dir=self.data_dir,
+                        database=self.name
+                    )
+        return self._backend
+
+    @property
+    def extractor(self):
+        if self._extractor is None:
+            from entity_extractor import MusicEntityExtractor
+            extractor = MusicEntityExtractor(backend=self.backend)
+            with self._lock:
+                if self._extractor is None:
+                    self._extractor = extractor
+        return self._extractor
+
+    @property
+    def router(self):
+        """分片内的检索路由器；缺少 numpy/scipy 时为 None"""
+        if self._router is None:
+            from retrieval_router import TemplateRouter, available
+            if not available():
+                return None
+            router = TemplateRouter(self.extractor)
+            with self._lock:
+                if self._router is None:
+                    self._router = router
+        return self._router
+
+    @property
+    def evicted(self) -> bool:
+        return self._evicted
+
+    # 使用计数：被淘汰时若仍有请求在用，等最后一个请求结束再关闭
+    def acquire(self):
+        with self._lock:
+            self._users += 1
+
+    def release(self):
+        with self._lock:
+            self._users -= 1
+            close = self._evicted and self._users == 0
+        if close:
+            self.close()
+
+    def evict(self):
+        with self._lock:
+            self._evicted = True
+            close = self._users == 0
+        if close:
+            self.close()
+
+    def close(self):
+        with self._lock:
+            backend, self._backend = self._backend, None
+            self._extractor = None
+            self._router = None
+        if backend is not None:
+            backend.close()
+
+
+class RoutingIndex:
+    """磁盘上的 实体名 → (分片, 类型) 索引"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS routes ("
+                "name TEXT NOT NULL, label TEXT NOT NULL, shard TEXT NOT NULL, "
+                "PRIMARY KEY (name, label, shard)) WITHOUT ROWID"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS versions ("
+                "shard TEXT PRIMARY KEY, version TEXT NOT NULL, csv TEXT NOT NULL DEFAULT '')"
+            )
+            if "csv" not in {row[1] for row in conn.execute("PRAGMA table_info(versions)")}:
+                conn.execute("ALTER TABLE versions ADD COLUMN csv TEXT NOT NULL DEFAULT ''")
+            self._local.conn = conn
+        return conn
+
+    def is_empty(self) -> bool:
+        return self.conn.execute("SELECT 1 FROM routes LIMIT 1").fetchone() is None
+
+    def build(self, shards: Dict[str, str]) -> Dict[str, int]:
+        """
+        从各分片目录的节点 CSV 重建路由，返回每个分片的实体数。
+        分片版本不清空：CSV 摘要与上次记录的不同时在原版本上推进，相同则保留
+        （包括导入脚本写入的版本），因此版本不会退回到用过的旧值
+        """
+        counts = {}
+        conn = self.conn
+        with conn:
+            conn.execute("DELETE FROM routes")
+            for name, data_dir in shards.items():
+                digest = csv_digest(data_dir)
+                row = conn.execute("SELECT csv FROM versions WHERE shard = ?", (name,)).fetchone()
+                if row is None or row[0] != digest:
+                    self._advance(name, f"csv:{digest}", csv=digest)
+                nodes, _ = read_csv_graph(data_dir)
+                before = conn.total_changes
+                for label, names in nodes.items():
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO routes (name, label, shard) VALUES (?, ?, ?)",
+                        ((entity, label, name) for entity in names)
+                    )
+                counts[name] = conn.total_changes - before
+        return counts
+
+    def version(self, shard: str) -> str:
+        """分片的数据版本（一次本地 SQLite 主键查找，不加载分片）"""
+        row = self.conn.execute("SELECT version FROM versions WHERE shard = ?", (shard,)).fetchone()
+        return row[0] if row else "0"
+
+    def _advance(self, shard: str, token: str, csv: str = None):
+        """在原版本上推进：新版本 = hash(原版本, token)，链式推导的版本不会与用过的旧值重复"""
+        row = self.conn.execute("SELECT version, csv FROM versions WHERE shard = ?", (shard,)).fetchone()
+        previous, previous_csv = row if row else ("0", "")
+        version = hashlib.sha1(f"{previous}\n{token}".encode("utf-8")).hexdigest()[:16]
+        self.conn.execute(
+            "INSERT OR REPLACE INTO versions (shard, version, csv) VALUES (?, ?, ?)",
+            (shard, version, previous_csv if csv is None else csv)
+        )
+        return version
+
+    def bump_version(self, shard: str, token: str) -> str:
+        """导入脚本导入某个分片后推进其版本（token 如 neo4j:<图数据版本>），返回新版本"""
+        with self.conn:
+            return self._advance(shard, token)
+
+    def has_versions(self, shards) -> bool:
+        known = {row[0] for row in self.conn.execute("SELECT shard FROM versions")}
+        return all(name in known for name in shards)
+
+    def lookup(self, entity: str) -> List[Tuple[str, str]]:
+        """返回 [(分片, 类型), ...]"""
+        rows = self.conn.execute("SELECT shard, label FROM routes WHERE name = ?", (entity,))
+        return [tuple(row) for row in rows]
+
+    def find_in_question(self, question: str) -> Optional[str]:
+        """
+        在问句中找索引里最长的实体名（问句没有命中模板正则时使用）。
+        只看问句前 MAX_QUESTION_LEN 个字，候选子串最多 MAX_QUESTION_LEN × MAX_ENTITY_LEN 个，分批查询。
+        """
+        question = question[:MAX_QUESTION_LEN]
+        candidates = sorted({
+            question[i:j]
+            for i in range(len(question))
+            for j in range(i + MIN_ENTITY_LEN, min(len(question), i + MAX_ENTITY_LEN) + 1)
+        }, key=len, reverse=True)
+        best = None
+        for start in range(0, len(candidates), LOOKUP_BATCH):
+            batch = candidates[start:start + LOOKUP_BATCH]
+            # 候选按长度降序分批，前一批命中的一定不短于后面各批
+            if best is not None and len(batch[0]) <= len(best):
+                break
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(f"SELECT DISTINCT name FROM routes WHERE name IN ({placeholders})", batch)
+            for (name,) in rows:
+                if best is None or len(name) > len(best):
+                    best = name
+        return best
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def csv_digest(data_dir: str) -> str:
+    """分片目录下各 CSV 的内容摘要"""
+    digest = hashlib.sha1()
+    for filename in list(NODE_FILES) + [RELATION_FILE]:
+        digest.update(filename.encode("utf-8"))
+        with open(os.path.join(data_dir, filename), "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def discover_shards(shards_dir: str) -> Dict[str, str]:
+    """分片目录下每个含完整 CSV 的子目录即一个分片，返回 {分片名: 目录}"""
+    shards = {}
+    required = list(NODE_FILES) + [RELATION_FILE]
+    for name in sorted(os.listdir(shards_dir)):
+        path = os.path.join(shards_dir, name)
+        if os.path.isdir(path) and all(os.path.exists(os.path.join(path, f)) for f in required):
+            shards[name] = path
+    return shards
+
+
+class ShardManager:
+    def __init__(self, shards_dir: str = SHARDS_DIR, max_loaded: int = MAX_LOADED_SHARDS):
+        self.shards_dir = shards_dir
+        self.shard_dirs = discover_shards(shards_dir)
+        self.index = RoutingIndex(os.path.join(shards_dir, ROUTING_INDEX_FILE))
+        if self.shard_dirs and (self.index.is_empty() or not self.index.has_versions(self.shard_dirs)):
+            print(f"分片路由索引为空或缺少分片版本，重建: {self.index.build(self.shard_dirs)}")
+        self._loaded = LRUCache(max_loaded, on_evict=lambda name, shard: shard.evict())
+        self._lock = threading.Lock()
+
+    def _acquire(self, name: str) -> Shard:
+        """
+        取出分片并加使用计数。查找、（必要时）创建和加计数都在 self._lock 内完成，
+        而 LRU 淘汰只发生在同一把锁内的 put 中，所以不会拿到一个正被淘汰关闭的分片；
+        已被淘汰的分片对象不再复用，重新创建一个放回 LRU。
+        """
+        with self._lock:
+            shard = self._loaded.get(name)
+            if shard is None or shard.evicted:
+                if name not in self.shard_dirs:
+                    raise KeyError(f"未知分片: {name}")
+                shard = Shard(name, self.shard_dirs[name])
+                self._loaded.put(name, shard)
+            shard.acquire()
+        return shard
+
+    @contextmanager
+    def use(self, names: List[str]):
+        """在请求期间持有若干分片，期间即使被 LRU 淘汰也不会关闭"""
+        shards = []
+        try:
+            for name in names:
+                shards.append(self._acquire(name))
+            yield shards
+        finally:
+            for shard in shards:
+                shard.release()
+
+    def shards_for_entity(self, entity: str, label: str = None) -> List[str]:
+        names = []
+        for shard, shard_label in self.index.lookup(entity):
+            if (label is None or shard_label == label) and shard not in names:
+                names.append(shard)
+        return names
+
+    def shards_for_question(self, question: str) -> Tuple[Optional[str], List[str]]:
+        """按问句提到的实体找分片：优先取模板正则的槽位实体，否则在索引里找问句中最长的实体名"""
+        from handler import extract_entity_for_kg_query
+        entity = extract_entity_for_kg_query(question) or self.index.find_in_question(question.strip())
+        if not entity:
+            return None, []
+        return entity, self.shards_for_entity(entity)
+
+    @contextmanager
+    def extractor_for(self, question: str):
+        """
+        问句所属（第一个）分片的实体抽取器，找不到分片时为 None。
+        上下文管理器：在 with 块内持有该分片，使用抽取器期间分片不会被淘汰释放
+        """
+        _, names = self.shards_for_question(question)
+        if not names:
+            yield None
+            return
+        with self.use(names[:1]) as (shard,):
+            yield shard.extractor
+
+    def shard_version(self, name: str) -> str:
+        """单个分片的数据版本，取自路由索引（查询结果缓存按分片校验版本，不加载分片）"""
+        return self.index.version(name)
+
+    def graph_version(self) -> str:
+        """全部分片数据版本的摘要"""
+        parts = [f"{name}={self.shard_version(name)}" for name in self.shard_dirs]
+        return "shards:" + hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()[:16]
+
+    def loaded(self) -> List[str]:
+        return [name for name, _ in self._loaded.items()]
+
+    def close(self):
+        for _, shard in self._loaded.items():
+            shard.close()
+        self._loaded.clear()
+        self.index.close()
+
+
+# ==============================================================================
+# 单例
+# ==============================================================================
+_manager_instance = None
+_manager_lock = threading.Lock()
+
+
+def get_shard_manager() -> Optional[ShardManager]:
+    """未设置 KG_SHARDS_DIR 时返回 None"""
+    global _manager_instance
+    if not sharding_enabled():
+        return None
+    if _manager_instance is None:
+        with _manager_lock:
+            if _manager_instance is None:
+                _manager_instance = ShardManager()
+    return _manager_instance
+
+
+def reset_shard_manager():
+    """关闭所有已加载分片（prefork 的 worker 启动后调用，连接不能跨进程共用）"""
+    global _manager_instance
+    with _manager_lock:
+        if _manager_instance is not None:
+            _manager_instance.close()
+            _manager_instance = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多歌手曲库分片管理")
+    parser.add_argument("command", choices=["build-index", "list"])
+    parser.add_argument("--shards-dir", default=SHARDS_DIR or os.path.join("..", "data", "shards"))
+    args = parser.parse_args()
+
+    shards = discover_shards(args.shards_dir)
+    if args.command == "list":
+        for name, path in shards.items():
+            print(f"{name}\t{path}")
+        return
+    index = RoutingIndex(os.path.join(args.shards_dir, ROUTING_INDEX_FILE))
+    counts = index.build(shards)
+    index.close()
+    for name, count in counts.items():
+        print(f"{name}: {count} 个实体")
+    print(f"路由索引已写入 {index.path}（类型: {', '.join(ENTITY_LABELS)}）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# coding=utf-8
+"""准入控制：CORS 预检不计费、统计接口需要令牌"""
+import pytest
+from flask import Flask, jsonify
+
+import admission
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_ENABLED", True)
+    monkeypatch.setattr(admission, "ADMISSION_STATS_TOKEN", "stats-secret")
+    app = Flask(__name__)
+    controller = admission.register_admission(app)
+    # 容量很小，便于观察计费：/query_v2 一次消耗 10 个令牌
+    controller.classes = {name: dict(conf, rate=0.0, burst=20.0) for name, conf in controller.classes.items()}
+    controller.store = admission.MemoryBucketStore()
+
+    @app.route('/query_v2', methods=['POST'])
+    def query_v2():
+        return jsonify({"state": 0})
+
+    return app.test_client()
+
+
+def test_preflight_is_not_charged(client):
+    for _ in range(5):
+        assert client.options('/query_v2').status_code == 200
+    # 预检没有消耗额度：两次真实请求都放行，第三次超额
+    assert client.post('/query_v2', json={}).status_code == 200
+    assert client.post('/query_v2', json={}).status_code == 200
+    assert client.post('/query_v2', json={}).status_code == 429
+
+
+def test_unserved_method_is_not_charged(client):
+    for _ in range(3):
+        assert client.get('/query_v2').status_code == 405
+    assert client.post('/query_v2', json={}).status_code == 200
+
+
+def test_stats_requires_token(client):
+    assert client.get('/admission/stats').status_code == 403
+    assert client.get('/admission/stats', headers={"X-Admission-Token": "wrong"}).status_code == 403
+    resp = client.get('/admission/stats', headers={"X-Admission-Token": "stats-secret"})
+    assert resp.status_code == 200
+    assert "clients" in resp.get_json()
+
+
+def test_stats_not_registered_without_token(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_ENABLED", True)
+    monkeypatch.setattr(admission, "ADMISSION_STATS_TOKEN", "")
+    app = Flask(__name__)
+    admission.register_admission(app)
+    assert app.test_client().get('/admission/stats').status_code == 404
@@ -0,0 +1,63 @@
+# coding=utf-8
+"""分片版本：导入 → 重建路由索引 → 查询结果缓存失效"""
+import os
+import shutil
+from functools import partial
+
+import pytest
+
+from csv_preflight import NODE_FILES, RELATION_FILE
+from graph_backend import DATA_DIR
+from query_cache import QueryResultCache
+from shards import ShardManager
+
+
+@pytest.fixture
+def shards_dir(tmp_path):
+    for name in ("a", "b"):
+        os.makedirs(tmp_path / name)
+        for filename in list(NODE_FILES) + [RELATION_FILE]:
+            shutil.copy(os.path.join(DATA_DIR, filename), tmp_path / name / filename)
+    return tmp_path
+
+
+def cached_query(cache, manager, calls):
+    """模拟 handler._run_template：范围为分片 a，版本取自路由索引"""
+    def run():
+        calls.append(1)
+        return [("周杰伦",)]
+    return cache.get_or_run([("shard:a", partial(manager.shard_version, "a"))], (2, "七里香", (), 1), run)
+
+
+def test_import_then_build_index_invalidates(shards_dir):
+    manager = ShardManager(str(shards_dir), max_loaded=1)
+    cache = QueryResultCache(version_ttl=0)
+    calls = []
+    seen = [manager.shard_version("a")]
+
+    cached_query(cache, manager, calls)
+    cached_query(cache, manager, calls)
+    assert len(calls) == 1
+    assert manager.loaded() == []  # 校验版本不加载分片
+
+    # 导入脚本 --shard a：推进版本，缓存失效
+    manager.index.bump_version("a", "neo4j:2")
+    seen.append(manager.shard_version("a"))
+    cached_query(cache, manager, calls)
+    assert len(calls) == 2
+
+    # 按提示重建路由索引：CSV 没变，导入写入的版本保留，缓存继续命中
+    manager.index.build(manager.shard_dirs)
+    assert manager.shard_version("a") == seen[-1]
+    cached_query(cache, manager, calls)
+    assert len(calls) == 2
+
+    # CSV 有变化后重建：版本推进到一个没用过的新值，缓存失效
+    with open(shards_dir / "a" / RELATION_FILE, "a", encoding="utf-8") as f:
+        f.write("\n")
+    manager.index.build(manager.shard_dirs)
+    assert manager.shard_version("a") not in seen
+    cached_query(cache, manager, calls)
+    assert len(calls) == 3
+    assert manager.shard_version("b") != manager.shard_version("a")
+    manager.close()
@@ -1,25 +1,59 @@
 # back_end/two_stage.py
-from llm import call_llm
-from handler import query_handler, get_relation_type_from_question, extract_head_entity  # ← 新增导入
-from entity_extractor import extract_triples_from_llm_answer
+from llm import generate_answer, generate_structured
+from handler import query_all, get_relation_type_from_question, extract_head_entity  # ← 新增导入
+from entity_extractor import extract_triples_from_llm_answer, parse_answer_and_triples
+from graph_backend import SQLITE_TEMPLATES
+from profiling import stage
+from retrieval_router import SLOT_LABELS
+from shards import get_shard_manager
+from contextlib import nullcontext
+import os
 import re
 
+# 单次调用模式：一次 LLM 调用同时得到回答和三元组（默认关闭，可按请求开启）
+QA_SINGLE_PASS = os.getenv("QA_SINGLE_PASS", "0") == "1"
 
-def two_stage_qa(question: str):
-    # ========== 阶段1：LLM 原始回答 ==========
-    llm_ans = call_llm(question)
-    print(f"【阶段1 - LLM原始回答】: {llm_ans}")
 
-    # ========== 阶段2：从 LLM 回答中抽取三元组 ==========
-    llm_triples = extract_triples_from_llm_answer(
-        llm_ans,
-        question,
-        allow_ungrounded=True
-    )
-    print(f"【阶段2 - 抽取三元组】: {llm_triples}")
+def two_stage_qa(question: str, single_pass: bool = None):
+    if single_pass is None:
+        single_pass = QA_SINGLE_PASS
+
+    # 分片部署时用问题所属分片的词典做三元组抽取；分片在阶段1、2期间保持占用，不会被淘汰
+    manager = get_shard_manager()
+    with manager.extractor_for(question) if manager is not None else nullcontext() as extractor:
+        if single_pass:
+            # ========== 阶段1+2：一次调用得到回答和三元组 ==========
+            with stage("llm_answer"):
+                raw_output, llm_metrics = generate_structured(question)
+            with stage("triple_extraction"):
+                llm_ans, llm_triples, extraction_path = parse_answer_and_triples(
+                    raw_output,
+                    question,
+                    allow_ungrounded=True,
+                    extractor=extractor
+                )
+            print(f"【阶段1 - LLM原始回答】: {llm_ans} {llm_metrics}")
+            print(f"【阶段2 - 抽取三元组】: {llm_triples} ({extraction_path})")
+        else:
+            # ========== 阶段1：LLM 原始回答 ==========
+            with stage("llm_answer"):
+                llm_ans, llm_metrics = generate_answer(question, extractor=extractor)
+            print(f"【阶段1 - LLM原始回答】: {llm_ans} {llm_metrics}")
+
+            # ========== 阶段2：从 LLM 回答中抽取三元组 ==========
+            with stage("triple_extraction"):
+                llm_triples = extract_triples_from_llm_answer(
+                    llm_ans,
+                    question,
+                    allow_ungrounded=True,
+                    extractor=extractor
+                )
+            extraction_path = "two_call"
+            print(f"【阶段2 - 抽取三元组】: {llm_triples}")
 
     # ========== 阶段3：查询知识库 ==========
-    kg_res = query_handler(question)
+    with stage("kg_query"):
+        kg_res = query_all(question)
     kg_answers = kg_res["data"] if kg_res["state"] == 0 and kg_res["data"] else []
     print(f"【阶段3 - KG查询结果】: {kg_answers}")
 
@@ -27,6 +61,12 @@ def two_stage_qa(question: str):
     head_entity = extract_head_entity(question)
     rel = get_relation_type_from_question(question)
 
+    # 检索式路由命中的 KG 结果可能来自路由错误的模板，只用于核验 LLM 回答，不用来修正答案
+    route = kg_res.get("route")
+    if route is not None:
+        head_entity = route["entity"] if SLOT_LABELS[route["template"]] == "作品" else ""
+        rel = SQLITE_TEMPLATES[route["template"]][1]
+
     # 对于前3种查询（歌曲→专辑/作词/歌手），head 就是歌曲名
     # 后4种是反向查询（人物/专辑→歌曲），此时不构造 (head, rel, tail) 三元组（或需调整）
     # 当前我们只处理正向关系（rel in {"歌手", "作词", "作曲"}）
@@ -41,10 +81,18 @@ def two_stage_qa(question: str):
     match_result = False
     if kg_triples and llm_triples:
         match_result = any(triple in kg_triples for triple in llm_triples)
+    if route is not None and not match_result and kg_answers:
+        # 路由问句没有模板槽位，抽取的三元组常缺 head；LLM 回答中直接出现 KG 答案也算核验通过
+        match_result = any(ans in llm_ans for ans in kg_answers)
 
     if match_result:
         final_answer = llm_ans
         print("【阶段4 - 匹配验证】: 匹配成功 → LLM回答正确")
+    elif route is not None:
+        route = dict(route, kg_answers=kg_answers)
+        kg_answers = []
+        final_answer = llm_ans if llm_ans.strip() not in {"", "未知"} else "未找到相关信息"
+        print("【阶段4 - 匹配验证】: 检索路由结果未能核验 LLM 回答，保留 LLM 回答")
     elif kg_answers:
         final_answer = ", ".join(kg_answers)
         print("【阶段4 - 匹配验证】: 匹配失败 → 使用KG事实修正答案")
@@ -55,7 +103,7 @@ def two_stage_qa(question: str):
     print(f"【最终答案】: {final_answer}")
     print("-" * 60)
 
-    return {
+    response = {
         "final_answer": final_answer,
         "is_hallucination": (not match_result) and bool(kg_answers),
         "source": "verified_by_kg_triple" if match_result else ("corrected_by_kg" if kg_answers else "llm_unverified"),
@@ -65,4 +113,9 @@ def two_stage_qa(question: str):
         "stage_4_match_result": match_result,
         "kg_answers": kg_answers,
         "llm_answer": llm_ans,
+        "llm_metrics": llm_metrics,
+        "extraction_path": extraction_path,
     }
+    if route is not None:
+        response["route"] = route
+    return response
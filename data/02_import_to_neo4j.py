@@ -1,18 +1,26 @@
 import os
-import csv
+import sys
+import argparse
 from neo4j import GraphDatabase
 
 # 获取当前脚本所在目录
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# CSV 预检（back_end/csv_preflight.py）、合作关系推导和图数据版本号（back_end/graph_backend.py）、
+# 分片路由索引（back_end/shards.py）与后端共用
+sys.path.insert(0, os.path.join(SCRIPT_DIR, "..", "back_end"))
+from csv_preflight import CsvPreflight, RELATION_LABELS
+from graph_backend import Neo4jBackend
+from shards import ROUTING_INDEX_FILE, RoutingIndex
+
 # 定义 data 目录路径
 DATA_DIR = os.path.join(SCRIPT_DIR)
 
-# 构造所有 CSV 文件的完整路径
-ALBUM_FILE = os.path.join(DATA_DIR, '专辑.csv')
-MUSIC_FILE = os.path.join(DATA_DIR, '音乐作品.csv')
-PERSON_FILE = os.path.join(DATA_DIR, '人物.csv')
-RELATION_FILE = os.path.join(DATA_DIR, 'relation.csv')
+# CSV 所在目录（--shard 时为 data/shards/<name>/）
+SOURCE_DIR = DATA_DIR
+
+# 每次 UNWIND 写入的行数
+BATCH_SIZE = 500
 
 # Neo4j 连接配置
 import os
@@ -21,6 +29,18 @@ NEO4J_USER = os.getenv('NEO4J_USER', "neo4j")
 NEO4J_PASSWORD = os.getenv('NEO4J_PASSWORD', "Aqweasd123.")
 driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
 
+# 目标数据库：None 为服务器默认库；--shard 时为与分片同名的数据库（见 back_end/shards.py）
+DATABASE = None
+
+
+def use_shard(name):
+    """改为导入 data/shards/<name>/ 下的 CSV 到名为 <name> 的 Neo4j 数据库"""
+    global DATABASE, SOURCE_DIR
+    SOURCE_DIR = os.path.join(DATA_DIR, 'shards', name)
+    DATABASE = name
+    with driver.session(database="system") as session:
+        session.run(f"CREATE DATABASE `{name}` IF NOT EXISTS WAIT").consume()
+
 
 def clear_db(tx):
     tx.run("MATCH (n) DETACH DELETE n")
@@ -47,84 +67,102 @@ def create_constraints(tx):
             raise e
 
 
-def load_nodes():
-    with driver.session() as session:
+def _batched(items, size=BATCH_SIZE):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def load_nodes(preflight):
+    """写入预检后的节点（已规范化、去重），每类按批 UNWIND"""
+    with driver.session(database=DATABASE) as session:
         # 清空旧数据（可选）
         # session.write_transaction(clear_db)
 
         # 创建约束
         session.write_transaction(create_constraints)
 
-        # 加载 专辑
-        with open(ALBUM_FILE, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                name = row['专辑名称']
-                if name.strip():
-                    session.run("MERGE (:专辑 {name: $name})", name=name)
-
-        # 加载 音乐作品
-        with open(MUSIC_FILE, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                name = row['所有音乐作品']
-                if name.strip():
-                    session.run("MERGE (:作品 {name: $name})", name=name)
-
-        # 加载 人物
-        with open(PERSON_FILE, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                name = row['人物列表']
-                if name.strip():
-                    session.run("MERGE (:人物 {name: $name})", name=name)
-
-
-def load_relations():
-    with driver.session() as session:
-        with open(RELATION_FILE, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                try:
-                    work = row['Column1'].strip()
-                    target = row['Column2'].strip()
-                    rel_type = row['Column3'].strip()
-
-                    if not work or not target or not rel_type:
-                        continue
-
-                    # 根据关系类型创建不同关系
-                    if rel_type == '所属专辑':
-                        session.run(
-                            "MATCH (w:作品 {name: $work}) "
-                            "MATCH (a:专辑 {name: $target}) "
-                            "MERGE (w)-[:所属专辑]->(a)",
-                            work=work, target=target
-                        )
-                    elif rel_type == '歌手':
-                        session.run(
-                            "MATCH (w:作品 {name: $work}) "
-                            "MATCH (p:人物 {name: $target}) "
-                            "MERGE (w)-[:歌手]->(p)",
-                            work=work, target=target
-                        )
-                    elif rel_type == '作词':
-                        session.run(
-                            "MATCH (w:作品 {name: $work}) "
-                            "MATCH (p:人物 {name: $target}) "
-                            "MERGE (w)-[:作词]->(p)",
-                            work=work, target=target
-                        )
-                    # 其他关系可扩展
-                except Exception as e:
-                    print(f"Error processing row: {row} | {e}")
+        for label, names in preflight.nodes().items():
+            for batch in _batched(names):
+                session.run(f"UNWIND $names AS name MERGE (:{label} {{name: name}})", names=batch).consume()
+
+
+def load_relations(preflight):
+    """
+    写入预检后的关系三元组（端点都存在、无重复），按关系类型分批 UNWIND。
+    返回关系有变化（新建了边）的作品名集合。
+    """
+    changed_works = set()
+    with driver.session(database=DATABASE) as session:
+        def flush(rel, rows):
+            head_label, tail_label = RELATION_LABELS[rel]
+            result = session.run(
+                "UNWIND $rows AS row "
+                f"MATCH (w:{head_label} {{name: row.head}}) "
+                f"MATCH (t:{tail_label} {{name: row.tail}}) "
+                f"OPTIONAL MATCH (w)-[old:{rel}]->(t) "
+                "WITH w, t, old "
+                f"MERGE (w)-[:{rel}]->(t) "
+                "WITH w, old WHERE old IS NULL "
+                "RETURN DISTINCT w.name AS work",
+                rows=rows
+            )
+            changed_works.update(record["work"] for record in result)
+
+        pending = {}
+        for head, rel, tail in preflight.relations():
+            rows = pending.setdefault(rel, [])
+            rows.append({"head": head, "tail": tail})
+            if len(rows) >= BATCH_SIZE:
+                flush(rel, rows)
+                pending[rel] = []
+        for rel, rows in pending.items():
+            if rows:
+                flush(rel, rows)
+    return changed_works
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导入 CSV 数据到 Neo4j")
+    parser.add_argument("--rebuild-collaborations", action="store_true",
+                        help="全量重算合作关系（默认只重算关系有变化的作品涉及的人物）")
+    parser.add_argument("--rejects", help="预检拒绝报告输出路径（CSV），默认不写出")
+    parser.add_argument("--shard", help="导入 data/shards/<SHARD>/ 到同名数据库（多歌手分片部署）")
+    args = parser.parse_args()
+    if args.shard:
+        use_shard(args.shard)
+
+    preflight = CsvPreflight(SOURCE_DIR, rejects_path=args.rejects)
     print("正在加载节点...")
-    load_nodes()
+    load_nodes(preflight)
     print("正在加载关系...")
-    load_relations()
+    changed_works = load_relations(preflight)
+    preflight.close()
+    print(f"CSV 预检：{preflight.report.summary()}")
+    if args.rejects:
+        print(f"被拒绝的行已写入 {args.rejects}")
+    # 合作关系：两个人物参与过同一作品即互为合作者，weight 为共同作品数（双向物化）。
+    # 增量模式只重算与变化作品相关的人物及其现有合作者；首次导入时所有作品都算作变化。
+    backend = Neo4jBackend(batch_size=BATCH_SIZE, database=DATABASE, driver=driver)
+    print("正在推导合作关系...")
+    if args.rebuild_collaborations:
+        created = backend.derive_collaborations()
+    else:
+        created = backend.derive_collaborations(changed_works)
+    print(f"关系有变化的作品 {len(changed_works)} 首，写入合作边 {created} 条")
+    # 递增图数据版本号（back_end 据此让评估输出缓存、查询结果缓存失效）
+    backend.bump_graph_version()
     print("✅ 数据导入完成！")
+    if args.shard:
+        # 分片版本记录在路由索引中，后端的查询结果缓存据此失效，不必加载分片
+        index = RoutingIndex(os.path.join(DATA_DIR, 'shards', ROUTING_INDEX_FILE))
+        index.bump_version(args.shard, f"neo4j:{backend.graph_version()}")
+        index.close()
+        print("分片数据有变化，请重建路由索引：cd back_end && KG_SHARDS_DIR=../data/shards python shards.py build-index")
     driver.close()
 